@@ -3,10 +3,38 @@ import threading
 import time
 from typing import Optional
 import redis
+import redis.asyncio as aioredis
 from models.user import User
 from models.jam import JamState
 
 
+# Fields of the jam state a client can send, and their name in `JamState`.
+JAM_STATE_FIELDS = {
+    "id": "id",
+    "currentTime": "currentTime",
+    "playing": "playing",
+    "volume": "volume",
+    "vocalOn": "vocal_on",
+    "is_on": "is_on",
+    "queueIdx": "queue_idx",
+}
+
+
+def jam_state_changes(jam_state: dict) -> dict:
+    """
+    The `JamState` fields set by the message of a client.
+    """
+    return {field: jam_state[key] for key, field in JAM_STATE_FIELDS.items() if key in jam_state}
+
+
+def update_jam_state(state: JamState, jam_state: dict):
+    """
+    Apply the fields sent by a client to the jam state.
+    """
+    for field, value in jam_state_changes(jam_state).items():
+        setattr(state, field, value)
+
+
 class RedisJamInterface:
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
@@ -91,15 +119,7 @@ class RedisJamInterface:
 
         with self.lock:
             state = self.get_jam_state(jam_id)
-        state.id = jam_state.get("id", state.id)
-        state.currentTime = jam_state.get(
-            "currentTime", state.currentTime)
-        state.playing = jam_state.get("playing", state.playing)
-        state.volume = jam_state.get("volume", state.volume)
-        state.vocal_on = jam_state.get("vocalOn", state.vocal_on)
-        state.is_on = jam_state.get("is_on", state.is_on)
-        state.queue_idx = jam_state.get(
-            "queueIdx", state.queue_idx)
+        update_jam_state(state, jam_state)
 
         # Only write to Redis every 1s (adjustable)
         if now - self.last_redis_update.get(jam_id, 0) >= 1.0:
@@ -108,3 +128,89 @@ class RedisJamInterface:
                           for k, v in state.model_dump().items()}
             self.redis.hset(key, mapping=serialized)
             self.last_redis_update[jam_id] = now
+
+
+class AsyncRedisJamInterface:
+    """
+    Asyncio counterpart of `RedisJamInterface`, for the `async def` routes and the
+    WebSocket handlers.
+
+    The state is not cached in the process: several API processes update the same jam,
+    so it is read from Redis every time, and each update only writes the fields sent
+    by the client.
+    """
+
+    def __init__(self, redis_client: aioredis.Redis):
+        self.redis = redis_client
+        self.jam_prefix = "jam:"
+        # Time and fields of the last write per jam, to rate-limit the playback ticks.
+        self.last_redis_update: dict[str, float] = {}
+        self.last_written: dict[str, dict] = {}
+
+    async def jam_exists(self, room_id: str) -> bool:
+        try:
+            room_key = f"{self.jam_prefix}{room_id}"
+            return bool(await self.redis.exists(room_key))
+        except redis.RedisError as e:
+            print(f"Error checking if jam {room_id} exists: {e}")
+            raise
+
+    def participants_key(self, jam_id: str) -> str:
+        return f"{self.jam_prefix}{jam_id}:participants"
+
+    async def add_participant(self, jam_id: str, connection_id: str, user: User):
+        """
+        Record a socket of `user` in the jam. Participants are kept per connection, a
+        user with sockets on several API processes stays in the jam until the last one
+        disconnects.
+        """
+        try:
+            await self.redis.hset(self.participants_key(jam_id), connection_id,
+                                  user.model_dump_json())
+        except redis.RedisError as e:
+            print(f"Error adding participant {user.id} to jam {jam_id}: {e}")
+            raise
+
+    async def remove_participant(self, jam_id: str, connection_id: str):
+        try:
+            await self.redis.hdel(self.participants_key(jam_id), connection_id)
+        except redis.RedisError as e:
+            print(f"Error removing connection {connection_id} from jam {jam_id}: {e}")
+            raise
+
+    async def get_participants(self, jam_id: str) -> list[User]:
+        """
+        The users connected to the jam from any API process, once each.
+        """
+        participants: dict[str, User] = {}
+        for raw in await self.redis.hvals(self.participants_key(jam_id)):
+            user = User(**json.loads(raw))
+            participants.setdefault(user.id, user)
+        return list(participants.values())
+
+    async def get_jam_state(self, jam_id: str) -> JamState:
+        key = f"{self.jam_prefix}{jam_id}"
+        raw_items = (await self.redis.hgetall(key)).items()
+        return JamState(**{"id": jam_id, **{k: json.loads(v) for k, v in raw_items}})
+
+    async def create_or_update_jam_state(self, jam_id, jam_state: Optional[dict] = None):
+        """
+        Update the jam state in Redis, with a single HSET of the fields sent by the
+        client, so concurrent updates of other fields from other processes are kept.
+        """
+        if not jam_state:
+            return
+        changes = jam_state_changes(jam_state)
+        if not changes:
+            return
+        now = time.time()
+        others = {k: v for k, v in changes.items() if k != "currentTime"}
+        if (others == self.last_written.get(jam_id)
+                and now - self.last_redis_update.get(jam_id, 0) < 1.0):
+            # Only the playback position moved, the owner sends it continuously while
+            # playing: write it every 1s (adjustable).
+            return
+        self.last_redis_update[jam_id] = now
+        self.last_written[jam_id] = others
+        key = f"{self.jam_prefix}{jam_id}"
+        await self.redis.hset(key, mapping={k: json.dumps(v) for k, v in changes.items()})
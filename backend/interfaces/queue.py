@@ -1,153 +1,190 @@
 import json
-import threading
-from typing import Callable, Optional, List, Any, Union
+from typing import Callable, Optional, List, Any, Set, Union
 import redis
-from managers.db import DatabaseManager
+import redis.asyncio as aioredis
 from models.track import Track
 import time
 
+# Progress of a track is published by the worker on `progress:{track_id}`.
+PROGRESS_CHANNEL_PREFIX = "progress:"
+
+
+def progress_channel(track_id: str) -> str:
+    return f"{PROGRESS_CHANNEL_PREFIX}{track_id}"
+
+
+# Every track ever requested, hash of track id -> Track JSON (without the queue fields),
+# and the set of ids of the tracks whose lyrics and stems are available. The worker adds
+# the tracks it finishes to the latter.
+CATALOG_KEY = "track_catalog"
+READY_TRACKS_KEY = "track_catalog:ready"
+
+
+# Room queues are stored as:
+#   room:{id}:queue:order   sorted set of entry keys (`{track id}:{time_added}`), scored
+#                           by position. Insertions take the middle of their neighbours.
+#   room:{id}:queue:tracks  hash of entry key -> Track JSON, as added.
+#   room:{id}:queue:status  hash of entry key -> `{"status": .., "progress": ..}`, the
+#                           processing status of the entry, overrides the Track JSON.
+# The scripts below edit them atomically in a single round trip. The former layout, a
+# list of Track JSON under room:{id}:queue, is migrated on first access.
+
+# Insert `member` at `index` (same semantics as `list.insert`), used by the scripts below.
+INSERT_AT = """
+local function insert_at(order, index, member)
+    local count = redis.call('ZCARD', order)
+    if index < 0 then
+        index = math.max(count + index, 0)
+    end
+    local score
+    if index >= count then
+        local last = redis.call('ZRANGE', order, -1, -1, 'WITHSCORES')
+        score = (tonumber(last[2]) or 0) + 1
+    elseif index == 0 then
+        local first = redis.call('ZRANGE', order, 0, 0, 'WITHSCORES')
+        score = tonumber(first[2]) - 1
+    else
+        local around = redis.call('ZRANGE', order, index - 1, index, 'WITHSCORES')
+        local before, after = tonumber(around[2]), tonumber(around[4])
+        score = (before + after) / 2
+        if score <= before or score >= after then
+            -- No room left between the neighbours, spread the scores again.
+            local members = redis.call('ZRANGE', order, 0, -1)
+            for i, m in ipairs(members) do
+                redis.call('ZADD', order, i, m)
+            end
+            score = index + 0.5
+        end
+    end
+    redis.call('ZADD', order, score, member)
+end
+"""
+
+# KEYS: order, tracks. ARGV: entry key, Track JSON. Returns the length of the queue.
+ADD_TRACK_SCRIPT = INSERT_AT + """
+insert_at(KEYS[1], redis.call('ZCARD', KEYS[1]), ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# KEYS: catalog, ready tracks. Returns the Track JSON of the ready tracks.
+GET_READY_TRACKS_SCRIPT = """
+local ids = redis.call('SMEMBERS', KEYS[2])
+if #ids == 0 then
+    return {}
+end
+return redis.call('HMGET', KEYS[1], unpack(ids))
+"""
+
+# KEYS: order, tracks, current index. ARGV: entry key, Track JSON.
+# Returns the index of the new entry.
+ADD_TO_NEXT_SCRIPT = INSERT_AT + """
+local current_idx = tonumber(redis.call('GET', KEYS[3]))
+if current_idx == nil then
+    current_idx = redis.call('ZCARD', KEYS[1]) == 0 and -1 or 0
+end
+local target_idx = current_idx + 1
+insert_at(KEYS[1], target_idx, ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return target_idx
+"""
+
+# KEYS: order, tracks, status. ARGV: entry key. Returns the Track JSON and status.
+REMOVE_TRACK_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return false
+end
+local entry = {redis.call('HGET', KEYS[2], ARGV[1]), redis.call('HGET', KEYS[3], ARGV[1])}
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+return entry
+"""
+
+# KEYS: order, tracks, status. ARGV: old index, new index.
+# Same as `tracks.insert(new, tracks.pop(old))`, returns the Track JSON and status.
+MOVE_TRACK_SCRIPT = INSERT_AT + """
+local member = redis.call('ZRANGE', KEYS[1], ARGV[1], ARGV[1])[1]
+if not member then
+    return false
+end
+redis.call('ZREM', KEYS[1], member)
+insert_at(KEYS[1], tonumber(ARGV[2]), member)
+return {redis.call('HGET', KEYS[2], member), redis.call('HGET', KEYS[3], member)}
+"""
+
+# KEYS: order, status. ARGV: entry key, status JSON. Ignores removed entries.
+UPDATE_STATUS_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: order, tracks, status. Returns the Track JSON and status of every entry, in order.
+GET_QUEUE_SCRIPT = """
+local members = redis.call('ZRANGE', KEYS[1], 0, -1)
+if #members == 0 then
+    return {{}, {}}
+end
+return {redis.call('HMGET', KEYS[2], unpack(members)),
+        redis.call('HMGET', KEYS[3], unpack(members))}
+"""
+
+# KEYS: order, tracks, status, current index. Removes the entries after the current one.
+CLEAR_QUEUE_SCRIPT = """
+local current_idx = tonumber(redis.call('GET', KEYS[4])) or 0
+local members = redis.call('ZRANGE', KEYS[1], current_idx + 1, -1)
+if #members == 0 then
+    return 0
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], current_idx + 1, -1)
+redis.call('HDEL', KEYS[2], unpack(members))
+redis.call('HDEL', KEYS[3], unpack(members))
+return #members
+"""
+
+
+def entry_key(track: Track) -> str:
+    """Key of the queue entry of `track`, a track can be queued several times."""
+    return f"{track.id}:{track.time_added}"
+
+
+def load_entry(track_data: str, status_data: Optional[str]) -> Track:
+    track = Track(**json.loads(track_data))
+    if status_data:
+        status = json.loads(status_data)
+        track.status = status["status"]
+        track.progress = status["progress"]
+    return track
+
+
+def write_queue(pipe: Any, keys: List[str], tracks: List[Track]) -> None:
+    """Queues the commands replacing the queue stored at `keys` with `tracks` on `pipe`."""
+    order_key, tracks_key, status_key = keys
+    pipe.delete(order_key, tracks_key, status_key)
+    if tracks:
+        pipe.zadd(order_key, {entry_key(track): i for i, track in enumerate(tracks)})
+        pipe.hset(tracks_key, mapping={entry_key(track): json.dumps(track.model_dump())
+                                       for track in tracks})
+
+
+def trim_track(track: Track) -> Track:
+    """The track without its queue fields, as stored in the catalog."""
+    return Track(id=track.id, name=track.name, artists=track.artists, album=track.album,)
+
+
+# Rooms whose queue was checked for the former layout by this process.
+_migrated_rooms: Set[str] = set()
+
 
 class RedisQueueInterface:
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
-        self.track_data_prefix = "track_data:"
         self.delay_key_prefix = "track_delay:"
         self.romanized_key_prefix = "romanized:"
         self.room_prefix = "room:"  # Added room prefix  # ADDED
 
-    # --- Queue Operations ---
-    def add_track_to_queue(self, room_id: str, track: Track) -> int:
-        try:
-            track.time_added = time.time_ns()
-            user_queue_key = f"{self.room_prefix}{room_id}:queue"
-            track_json = json.dumps(track.model_dump())
-            idx = self.redis.rpush(user_queue_key, track_json)
-            trimmed_track = Track(id=track.id, name=track.name, artists=track.artists, album=track.album,)
-            self.redis.sadd(self.track_data_prefix, json.dumps(trimmed_track.model_dump()))
-            return idx  # type: ignore
-        except redis.RedisError as e:
-            print(f"Error adding track to room queue {room_id}: {e}")
-            raise
-
-    def add_track_to_next(self, room_id: str, track: Track) -> int:
-        """
-        Adds a new track or moves an existing track to be the next song after the current playing song,
-
-        """
-        try:
-            # Get current queue before adding to it
-            current_queue = self.get_queue(room_id)
-            current_idx_key = f"room:{room_id}:queue:current_idx"
-            if not self.redis.exists(current_idx_key):
-                if not current_queue:
-                    current_idx = -1
-                else:
-                    current_idx = 0
-            else:
-                current_idx = json.loads(
-                    self.redis.get(current_idx_key))  # type: ignore
-
-            # New track: assign timestamp and add to track set
-            track.time_added = time.time_ns()
-            track_json_for_set = json.dumps(track.model_dump())
-            self.redis.sadd(self.track_data_prefix, track_json_for_set)
-
-            target_idx = current_idx + 1
-
-            current_queue.insert(
-                target_idx, track)
-            self.set_queue(room_id, current_queue)
-
-            return target_idx
-
-        except redis.RedisError as e:
-            print(
-                f"Redis error in add_track_to_next for room {room_id} with track ID {track.id if track else 'N/A'}: {e}")
-            raise
-        except Exception as e:
-            print(
-                f"Unexpected error in add_track_to_next for room {room_id} with track ID {track.id if track else 'N/A'}: {e}")
-            raise
-
-    def remove_track_from_queue(self, room_id: str, track: Track) -> Optional[dict]:
-        try:
-            user_queue_key = f"{self.room_prefix}{room_id}:queue"
-            queue_length: int = self.redis.llen(user_queue_key)  # type: ignore
-            for i in range(queue_length):
-                track_data: Any = self.redis.lindex(
-                    user_queue_key, i)  # type: ignore
-                if track_data:
-                    stored_track = Track(**json.loads(track_data))
-                    if stored_track.id == track.id and stored_track.time_added == track.time_added:
-                        self.redis.lrem(user_queue_key, 1, track_data)
-                        return stored_track.model_dump()
-            return None  # not found
-        except redis.RedisError as e:
-            print(f"Error removing track from room queue {room_id}: {e}")
-            raise
-
-    def set_queue(self, room_id: str, tracks: List[Track]) -> Any:
-        try:
-            user_queue_key = f"{self.room_prefix}{room_id}:queue"
-            self.redis.delete(user_queue_key)  # Clear existing queue
-            for track in tracks:
-                track_json = json.dumps(track.model_dump())
-                self.redis.rpush(user_queue_key, track_json)
-        except redis.RedisError as e:
-            print(f"Error setting track queue for room {room_id}: {e}")
-            return {"error": str(e)}
-
-    def get_queue(self, room_id: Optional[str] = None) -> List[Track]:
-        try:
-            if room_id is None:
-                key = self.track_data_prefix
-                data: list[Any] = self.redis.smembers(key)  # type: ignore
-            else:
-                key = f"{self.room_prefix}{room_id}:queue"
-                data: list[Any] = self.redis.lrange(
-                    key, 0, -1)  # type: ignore
-            tracks = [Track(**json.loads(track_data)) for track_data in data]
-            return tracks
-        except redis.RedisError as e:
-            print(f"Error getting track queue for room {room_id}: {e}")
-            return []
-
-    def update_track_status(self, room_id: str, track: Track) -> None:
-        """
-        Updates the status of a track in the queue.
-
-        Args:
-            room_id: The ID of the room.
-            track: The Track object with updated status.
-        """
-        try:
-            user_queue_key = f"{self.room_prefix}{room_id}:queue"
-            queue_length: int = self.redis.llen(user_queue_key)  # type: ignore
-            for i in range(queue_length):
-                track_data: Any = self.redis.lindex(
-                    user_queue_key, i)  # type: ignore
-                if track_data:
-                    stored_track = Track(**json.loads(track_data))
-                    if stored_track.id == track.id and stored_track.time_added == track.time_added:
-                        stored_track.status = track.status
-                        stored_track.progress = track.progress
-                        self.redis.lset(user_queue_key, i, json.dumps(
-                            stored_track.model_dump()))
-                        break
-        except redis.RedisError as e:
-            print(f"Error updating track status for room {room_id}: {e}")
-            raise
-
-    def clear_queue(self, room_id: str) -> None:
-        try:
-            user_queue_key = f"{self.room_prefix}{room_id}:queue"
-            idx_key = f"room:{room_id}:queue:current_idx"
-            current_idx: int = self.redis.get(idx_key)  # type: ignore
-            self.redis.ltrim(user_queue_key, 0, current_idx)
-        except redis.RedisError as e:
-            print(f"Error clearing track queue for room {room_id}: {e}")
-            raise
-
     def create_room(self, room_id: str) -> None:
         """
         Creates a room and its associated queue.
@@ -243,36 +280,6 @@ class RedisQueueInterface:
             print(f"Error publishing message: {e}")
             raise
 
-    def subscribe_to_channel(self, channel: str, callback: Callable) -> threading.Thread:
-        def _subscriber_thread(redis_client, channel_name, callback_func):  # Pass redis_client
-            pubsub = redis_client.pubsub()
-            pubsub.subscribe(channel_name)
-            for message in pubsub.listen():
-                if message["type"] == "message":
-                    try:
-                        data = json.loads(message["data"])
-                        # Since we're in a thread, we need to use asyncio.run_coroutine_threadsafe
-                        # to interact with the main thread's event loop if the callback
-                        # does any async operations.
-                        callback_func(data)
-                    except json.JSONDecodeError:
-                        print(
-                            f"Error decoding JSON message on channel {channel_name}: {message['data']}")
-                    except Exception as e:
-                        print(
-                            f"Error processing message on channel {channel_name}: {e}")
-
-        # Get a fresh connection for the subscriber thread.  Important!
-        # Get new redis instance.
-        subscriber_redis = DatabaseManager().get_session()
-        thread = threading.Thread(
-            target=_subscriber_thread, args=(
-                subscriber_redis, channel, callback)
-        )  # Pass the redis client
-        thread.daemon = True  # Allow the main thread to exit even if this is running
-        thread.start()
-        return thread
-
     def check_romanized_lyrics(self, track_id: str) -> bool:
         """
         Checks if romanized lyrics exist for a given track ID.
@@ -331,3 +338,227 @@ class RedisQueueInterface:
         except redis.RedisError as e:
             print(f"Error getting track delay: {e}")
             return None
+
+
+class AsyncRedisQueueInterface:
+    """
+    Queue and catalog operations, for the `async def` routes: the commands are awaited
+    instead of blocking the event loop. Lyrics and rooms are in `RedisQueueInterface`.
+    """
+
+    def __init__(self, redis_client: aioredis.Redis):
+        self.redis = redis_client
+        # Former catalog, a set of Track JSON, see `migrate_track_data`.
+        self.track_data_prefix = "track_data:"
+        self.room_prefix = "room:"
+        self._add_track = self.redis.register_script(ADD_TRACK_SCRIPT)
+        self._add_to_next = self.redis.register_script(ADD_TO_NEXT_SCRIPT)
+        self._remove_track = self.redis.register_script(REMOVE_TRACK_SCRIPT)
+        self._move_track = self.redis.register_script(MOVE_TRACK_SCRIPT)
+        self._update_status = self.redis.register_script(UPDATE_STATUS_SCRIPT)
+        self._get_queue = self.redis.register_script(GET_QUEUE_SCRIPT)
+        self._clear_queue = self.redis.register_script(CLEAR_QUEUE_SCRIPT)
+        self._get_ready_tracks = self.redis.register_script(GET_READY_TRACKS_SCRIPT)
+
+    # --- Queue Operations ---
+    async def _queue_keys(self, room_id: str) -> List[str]:
+        """
+        Keys of the order, tracks and status of the room's queue, migrating the queue
+        from the former layout if needed.
+        """
+        queue_key = f"{self.room_prefix}{room_id}:queue"
+        keys = [f"{queue_key}:order", f"{queue_key}:tracks", f"{queue_key}:status"]
+        if room_id not in _migrated_rooms:
+            await self._migrate_queue(room_id, queue_key, keys)
+            _migrated_rooms.add(room_id)
+        return keys
+
+    async def _migrate_queue(self, room_id: str, legacy_key: str, keys: List[str]) -> None:
+        """
+        Converts a queue stored as a list of Track JSON, kept in order. Runs in a
+        transaction watching the list, retried if another process edits it meanwhile.
+        """
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(legacy_key)
+                    if await pipe.type(legacy_key) != "list":
+                        return
+                    tracks = [Track(**json.loads(track_data))
+                              for track_data in await pipe.lrange(legacy_key, 0, -1)]
+                    pipe.multi()
+                    write_queue(pipe, keys, tracks)
+                    pipe.delete(legacy_key)
+                    await pipe.execute()
+                    print(f"Migrated the queue of room {room_id} ({len(tracks)} tracks)")
+                    return
+                except redis.WatchError:
+                    continue
+
+    async def add_track_to_queue(self, room_id: str, track: Track) -> int:
+        try:
+            track.time_added = time.time_ns()
+            track_json = json.dumps(track.model_dump())
+            idx = await self._add_track(keys=await self._queue_keys(room_id),
+                                        args=[entry_key(track), track_json])
+            await self.add_to_catalog(track, ready=track.status == "ready")
+            return idx  # type: ignore
+        except redis.RedisError as e:
+            print(f"Error adding track to room queue {room_id}: {e}")
+            raise
+
+    async def add_track_to_next(self, room_id: str, track: Track) -> int:
+        """
+        Adds a new track to be the next song after the current playing song.
+        """
+        try:
+            track.time_added = time.time_ns()
+            track_json = json.dumps(track.model_dump())
+            await self.add_to_catalog(track, ready=track.status == "ready")
+
+            order_key, tracks_key, _ = await self._queue_keys(room_id)
+            current_idx_key = f"room:{room_id}:queue:current_idx"
+            return await self._add_to_next(keys=[order_key, tracks_key, current_idx_key],
+                                           args=[entry_key(track), track_json])  # type: ignore
+        except redis.RedisError as e:
+            print(
+                f"Redis error in add_track_to_next for room {room_id} with track ID {track.id}: {e}")
+            raise
+
+    async def remove_track_from_queue(self, room_id: str, track: Track) -> Optional[dict]:
+        try:
+            entry: Any = await self._remove_track(
+                keys=await self._queue_keys(room_id), args=[entry_key(track)])
+            if entry:
+                return load_entry(*entry).model_dump()
+            return None  # not found
+        except redis.RedisError as e:
+            print(f"Error removing track from room queue {room_id}: {e}")
+            raise
+
+    async def move_track(self, room_id: str, old_idx: int, new_idx: int) -> Optional[Track]:
+        """
+        Moves the track at `old_idx` to `new_idx` in the queue.
+
+        Args:
+            room_id: The ID of the room.
+            old_idx: The current index of the track.
+            new_idx: The index of the track after the move.
+
+        Returns:
+            The moved track, or None if there is no track at `old_idx`.
+        """
+        try:
+            entry: Any = await self._move_track(
+                keys=await self._queue_keys(room_id), args=[old_idx, new_idx])
+            if entry:
+                return load_entry(*entry)
+            return None
+        except redis.RedisError as e:
+            print(f"Error moving track in room queue {room_id}: {e}")
+            raise
+
+    async def set_queue(self, room_id: str, tracks: List[Track]) -> None:
+        """
+        Replaces the room's queue with `tracks`, in a single MULTI/EXEC round trip so
+        readers never see a partial queue.
+        """
+        try:
+            keys = await self._queue_keys(room_id)
+            async with self.redis.pipeline() as pipe:
+                write_queue(pipe, keys, tracks)
+                await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error setting track queue for room {room_id}: {e}")
+            raise
+
+    async def get_queue(self, room_id: str) -> List[Track]:
+        try:
+            entries, statuses = await self._get_queue(
+                keys=await self._queue_keys(room_id))  # type: ignore
+            return [load_entry(track_data, status_data)
+                    for track_data, status_data in zip(entries, statuses) if track_data]
+        except redis.RedisError as e:
+            print(f"Error getting track queue for room {room_id}: {e}")
+            return []
+
+    async def update_track_status(self, room_id: str, track: Track) -> None:
+        """
+        Updates the status of a track in the queue.
+
+        Args:
+            room_id: The ID of the room.
+            track: The Track object with updated status.
+        """
+        try:
+            order_key, _, status_key = await self._queue_keys(room_id)
+            await self._update_status(keys=[order_key, status_key], args=[
+                entry_key(track), json.dumps({"status": track.status, "progress": track.progress})])
+        except redis.RedisError as e:
+            print(f"Error updating track status for room {room_id}: {e}")
+            raise
+
+    async def clear_queue(self, room_id: str) -> None:
+        try:
+            idx_key = f"room:{room_id}:queue:current_idx"
+            await self._clear_queue(keys=[*await self._queue_keys(room_id), idx_key])
+        except redis.RedisError as e:
+            print(f"Error clearing track queue for room {room_id}: {e}")
+            raise
+
+    # --- Track Catalog ---
+    async def add_to_catalog(self, track: Track, ready: bool = False) -> None:
+        """
+        Adds or updates a track in the catalog, keyed by its id so a track is only
+        stored once.
+
+        Args:
+            track: The track, its queue fields are left out.
+            ready: Whether the lyrics and stems of the track are already available.
+        """
+        try:
+            async with self.redis.pipeline() as pipe:
+                pipe.hset(CATALOG_KEY, track.id, json.dumps(trim_track(track).model_dump()))
+                if ready:
+                    pipe.sadd(READY_TRACKS_KEY, track.id)
+                await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Error adding track {track.id} to the catalog: {e}")
+            raise
+
+    async def get_ready_tracks(self) -> List[Track]:
+        """
+        Returns the tracks of the catalog that can be played.
+        """
+        try:
+            data: list[Any] = await self._get_ready_tracks(
+                keys=[CATALOG_KEY, READY_TRACKS_KEY])  # type: ignore
+            return [Track(**json.loads(track_data)) for track_data in data if track_data]
+        except redis.RedisError as e:
+            print(f"Error getting ready tracks: {e}")
+            return []
+
+    async def migrate_track_data(self, is_ready: Callable[[Track], bool]) -> None:
+        """
+        Moves the tracks of the former catalog, a set of Track JSON with duplicates,
+        to the catalog hash. `is_ready` tells which ones go to the ready tracks.
+        """
+        try:
+            data: list[Any] = await self.redis.smembers(self.track_data_prefix)  # type: ignore
+            if not data:
+                return
+            tracks = {}
+            for track_data in data:
+                track = Track(**json.loads(track_data))
+                tracks[track.id] = trim_track(track)
+            ready = [track_id for track_id, track in tracks.items() if is_ready(track)]
+            async with self.redis.pipeline() as pipe:
+                pipe.hset(CATALOG_KEY, mapping={track_id: json.dumps(track.model_dump())
+                                                for track_id, track in tracks.items()})
+                if ready:
+                    pipe.sadd(READY_TRACKS_KEY, *ready)
+                pipe.delete(self.track_data_prefix)
+                await pipe.execute()
+            print(f"Migrated {len(tracks)} tracks to the catalog, {len(ready)} ready")
+        except redis.RedisError as e:
+            print(f"Error migrating the track catalog: {e}")
@@ -1,17 +1,17 @@
-import asyncio
-import json
 import random
+from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI, WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 from managers.storage import get_storage_manager
 from models.track import Track
 from services.process_request import is_ready, send_process_request
-from managers.db import get_db
-from interfaces.queue import RedisQueueInterface
+from managers.db import get_async_db
+from interfaces.queue import AsyncRedisQueueInterface
 from services.spotify import getCollectionTracks, getTopCategories, searchSpotify
+from managers.pubsub import get_pubsub
 from managers.websocket import WebSocketManager
-from middlewares.format import FormatReponseMiddleware
+from middlewares.format import CamelJSONResponse
 from routes.track import router as track_router
 from routes.lyrics import router as lyrics_router
 from routes.queue import router as queue_router
@@ -20,9 +20,17 @@ from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
-app = FastAPI(root_path="/api")
 
-app.add_middleware(FormatReponseMiddleware)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tracks used to be stored in a set of JSON, move them to the catalog hash once.
+    await AsyncRedisQueueInterface(get_async_db()).migrate_track_data(is_ready)
+    yield
+    await get_pubsub().close()
+
+
+app = FastAPI(root_path="/api", default_response_class=CamelJSONResponse, lifespan=lifespan)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -44,58 +52,53 @@ async def root():
     Root endpoint to check if the server is running.
     Returns a simple JSON response.
     """
-    return JSONResponse(content={"message": "Server is running!"}, status_code=200)
+    return CamelJSONResponse(content={"message": "Server is running!"}, status_code=200)
 
 
 @app.get("/top-categories")
-async def get_top_categories(keyword: str):
+def get_top_categories(keyword: str):
     """
     Endpoint to fetch the top categories.
     Returns a list of dictionaries containing category details.
     """
-    return JSONResponse(content={"categories": getTopCategories(keyword)}, status_code=200)
+    return CamelJSONResponse(content={"categories": getTopCategories(keyword)}, status_code=200)
 
 
 @app.get("/playlist/{playlist_id}/tracks")
-async def get_playlist_tracks(playlist_id: str):
+def get_playlist_tracks(playlist_id: str):
     """
     Endpoint to fetch tracks from a specific playlist.
     Returns a list of dictionaries containing track details.
     """
     collection, tracks = getCollectionTracks("playlists", playlist_id)
-    return JSONResponse(content={"collection": collection, "tracks": tracks})
+    return CamelJSONResponse(content={"collection": collection, "tracks": tracks})
 
 
 @app.get("/album/{album_id}/tracks")
-async def get_album_tracks(album_id: str):
+def get_album_tracks(album_id: str):
     """
     Endpoint to fetch tracks from a specific playlist.
     Returns a list of dictionaries containing track details.
     """
     collection, tracks = getCollectionTracks("albums", album_id)
-    return JSONResponse(content={"collection": collection, "tracks": tracks})
+    return CamelJSONResponse(content={"collection": collection, "tracks": tracks})
 
 
 @app.get("/tracks")
 async def get_tracks(
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),):
-    tracks = redis_interface.get_queue()
-    ready_tracks = []
-    for track in tracks:
-        if is_ready(track):
-            ready_tracks.append(track.model_dump())
-
-    return JSONResponse(content={"ready_tracks": ready_tracks}, status_code=200)
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),):
+    ready_tracks = [track.model_dump() for track in await redis_interface.get_ready_tracks()]
+    return CamelJSONResponse(content={"ready_tracks": ready_tracks}, status_code=200)
 
 
 @app.get("/random_tracks")
-async def get_random_tracks():
+def get_random_tracks():
     default_playlist_id = "3AEkt2VeAAHFc1TC5FLuIl"
     _, tracks = getCollectionTracks("playlists", default_playlist_id)
     tracks = tracks or []
     random.shuffle(tracks)
-    return JSONResponse(content={"tracks": tracks[:10]}, status_code=200)
+    return CamelJSONResponse(content={"tracks": tracks[:10]}, status_code=200)
 
 
 @app.get("/search")
@@ -105,41 +108,36 @@ def search(q: str):
     Returns a list of dictionaries containing song details.
     """
     searchResults = searchSpotify(q)
-    return JSONResponse(content=searchResults, status_code=200)
+    return CamelJSONResponse(content=searchResults, status_code=200)
 
 
 @app.post("/download")
-async def download_track(track: Track, redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db()))):
+async def download_track(track: Track, redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db()))):
     """
     Download a track based on the provided track object.
     Returns a JSON response indicating the status of the download.
     """
-    if is_ready(track):
-        return JSONResponse(content={"task": None}, status_code=200)
-
-    trimmed_track = Track(id=track.id, name=track.name, artists=track.artists, album=track.album,)
-    redis_interface.redis.sadd(
-        redis_interface.track_data_prefix, json.dumps(trimmed_track.model_dump()))
-    loop = asyncio.get_event_loop()
-
-    def process_message_callback(message_data: dict):
-        """
-        Callback to handle messages from the Redis pub/sub related to track processing.
-        """
-        asyncio.run_coroutine_threadsafe(ws_manager.broadcast(
-            message_data), loop)
+    if await run_in_threadpool(is_ready, track):
+        return CamelJSONResponse(content={"task": None}, status_code=200)
 
-    redis_interface.subscribe_to_channel(
-        track.id, process_message_callback)
-
-    task = send_process_request(track)
-    return JSONResponse(content={"task": task.id}, status_code=200)
+    # The progress of the track reaches the clients through the WebSocket manager.
+    await redis_interface.add_to_catalog(track)
+    task = await run_in_threadpool(send_process_request, track)
+    return CamelJSONResponse(content={"task": task.id}, status_code=200)
 
 ws_manager = WebSocketManager()
 # websocket endpoint for real-time updates
 
 
+@app.get("/ws/stats")
+async def websocket_stats():
+    """
+    Fan-out latency percentiles and lagging clients of the WebSocket manager.
+    """
+    return ws_manager.stats()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await ws_manager.websocket_endpoint(websocket)
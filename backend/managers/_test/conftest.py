@@ -0,0 +1,45 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend directory, so that the modules can be imported as the API does.
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+# These tests run against fakeredis, with lupa for the Lua scripts of the queue.
+if any(importlib.util.find_spec(name) is None
+       for name in ("pydantic", "redis", "fakeredis", "lupa")):
+    collect_ignore_glob = ["test_queue_*.py", "test_catalog_*.py", "test_jam_*.py",
+                           "test_pubsub.py"]
+
+
+@pytest.fixture
+def make_track():
+    from models.track import Artist, Track
+
+    def make(track_id: str, **fields) -> Track:
+        return Track(id=track_id, name=f"Song {track_id}",
+                     artists=[Artist(id="artist", uri="", name="Artist")], **fields)
+    return make
+
+
+@pytest.fixture
+def redis_server():
+    """A fresh fakeredis server, shared by the clients of a test like a real one."""
+    import fakeredis
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def async_redis(redis_server):
+    import fakeredis
+    return fakeredis.aioredis.FakeRedis(server=redis_server, decode_responses=True)
+
+
+@pytest.fixture
+def interface(async_redis, monkeypatch):
+    import interfaces.queue as queue_module
+    # Rooms are checked for the former queue layout once per process.
+    monkeypatch.setattr(queue_module, "_migrated_rooms", set())
+    return queue_module.AsyncRedisQueueInterface(async_redis)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from interfaces.queue import CATALOG_KEY, READY_TRACKS_KEY, AsyncRedisQueueInterface
+from models.track import Track
+
+LEGACY_KEY = "track_data:"
+
+
+def ready_ids(interface: AsyncRedisQueueInterface) -> list[str]:
+    return sorted(track.id for track in asyncio.run(interface.get_ready_tracks()))
+
+
+def test_legacy_set_is_deduplicated_into_the_catalog(interface, make_track):
+    # The former set held one JSON per queueing, with the queue fields.
+    asyncio.run(interface.redis.sadd(LEGACY_KEY, *[json.dumps(track.model_dump()) for track in [
+        make_track("a", time_added=1, status="processing"),
+        make_track("a", time_added=2, status="ready", progress=100.),
+        make_track("b", time_added=3),
+    ]]))
+
+    asyncio.run(interface.migrate_track_data(lambda track: track.id == "a"))
+
+    catalog = asyncio.run(interface.redis.hgetall(CATALOG_KEY))
+    assert sorted(catalog) == ["a", "b"]
+    stored = Track(**json.loads(catalog["a"]))
+    assert (stored.time_added, stored.status, stored.progress) == (None, None, None)
+    assert asyncio.run(interface.redis.smembers(READY_TRACKS_KEY)) == {"a"}
+    assert not asyncio.run(interface.redis.exists(LEGACY_KEY))
+    assert ready_ids(interface) == ["a"]
+
+
+def test_migration_without_ready_tracks(interface, make_track):
+    asyncio.run(interface.redis.sadd(LEGACY_KEY, json.dumps(make_track("a").model_dump())))
+
+    asyncio.run(interface.migrate_track_data(lambda track: False))
+
+    assert asyncio.run(interface.redis.hkeys(CATALOG_KEY)) == ["a"]
+    assert ready_ids(interface) == []
+
+
+def test_migration_is_a_no_op_once_done(interface, make_track):
+    asyncio.run(interface.add_to_catalog(make_track("a"), ready=True))
+
+    asyncio.run(interface.migrate_track_data(lambda track: False))
+
+    assert ready_ids(interface) == ["a"]
+
+
+def test_catalog_keeps_one_entry_per_track(interface, make_track):
+    asyncio.run(interface.add_to_catalog(make_track("a", time_added=1)))
+    asyncio.run(interface.add_to_catalog(make_track("a", time_added=2), ready=True))
+    asyncio.run(interface.add_to_catalog(make_track("b")))
+
+    assert asyncio.run(interface.redis.hlen(CATALOG_KEY)) == 2
+    assert ready_ids(interface) == ["a"]
+
+
+def test_queueing_a_track_adds_it_to_the_catalog(interface, make_track):
+    asyncio.run(interface.add_track_to_queue("room-1", make_track("a")))
+    asyncio.run(interface.add_track_to_next("room-1", make_track("b", status="ready")))
+
+    assert sorted(asyncio.run(interface.redis.hkeys(CATALOG_KEY))) == ["a", "b"]
+    assert ready_ids(interface) == ["b"]
+
+
+def test_ready_index_without_catalog_entry_is_skipped(interface, make_track):
+    asyncio.run(interface.redis.sadd(READY_TRACKS_KEY, "missing"))
+    asyncio.run(interface.add_to_catalog(make_track("a"), ready=True))
+
+    assert ready_ids(interface) == ["a"]
@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+import interfaces.jam as jam_module
+from interfaces.jam import AsyncRedisJamInterface
+from models.user import User
+
+JAM = "room-1"
+
+
+@pytest.fixture
+def jams(redis_server):
+    """Two interfaces on the same server, as in two API processes."""
+    return [AsyncRedisJamInterface(
+        fakeredis.aioredis.FakeRedis(server=redis_server, decode_responses=True))
+        for _ in range(2)]
+
+
+def test_missing_jam_has_default_state(jams):
+    state = asyncio.run(jams[0].get_jam_state(JAM))
+
+    assert state.id == JAM
+    assert (state.playing, state.volume, state.queue_idx) == (False, 0.8, None)
+
+
+def test_updates_from_other_processes_are_read(jams):
+    first, second = jams
+    asyncio.run(first.create_or_update_jam_state(JAM, {"playing": True, "queueIdx": 2}))
+    asyncio.run(second.get_jam_state(JAM))
+
+    asyncio.run(first.create_or_update_jam_state(JAM, {"playing": False}))
+
+    state = asyncio.run(second.get_jam_state(JAM))
+    assert (state.playing, state.queue_idx) == (False, 2)
+
+
+def test_only_the_sent_fields_are_written(jams):
+    first, second = jams
+    asyncio.run(first.create_or_update_jam_state(JAM, {"vocalOn": True, "volume": 0.5}))
+
+    asyncio.run(second.create_or_update_jam_state(JAM, {"currentTime": 12.5, "playing": True}))
+
+    state = asyncio.run(first.get_jam_state(JAM))
+    assert (state.vocal_on, state.volume) == (True, 0.5)
+    assert (state.currentTime, state.playing) == (12.5, True)
+
+
+def test_playback_ticks_are_rate_limited(jams, monkeypatch):
+    jam = jams[0]
+    now = [100.]
+    monkeypatch.setattr(jam_module, "time", SimpleNamespace(time=lambda: now[0]))
+    tick = {"currentTime": 1., "playing": True, "queueIdx": 0}
+    asyncio.run(jam.create_or_update_jam_state(JAM, tick))
+
+    now[0] += 0.5
+    asyncio.run(jam.create_or_update_jam_state(JAM, {**tick, "currentTime": 1.5}))
+    assert asyncio.run(jam.get_jam_state(JAM)).currentTime == 1.
+
+    # A control change is written right away, whatever the time since the last write.
+    paused = {**tick, "playing": False}
+    asyncio.run(jam.create_or_update_jam_state(JAM, {**paused, "currentTime": 1.6}))
+    assert asyncio.run(jam.get_jam_state(JAM)).playing is False
+
+    now[0] += 1.
+    asyncio.run(jam.create_or_update_jam_state(JAM, {**paused, "currentTime": 2.6}))
+    assert asyncio.run(jam.get_jam_state(JAM)).currentTime == 2.6
+
+
+
+def participant_ids(jam: AsyncRedisJamInterface) -> list[str]:
+    return sorted(user.id for user in asyncio.run(jam.get_participants(JAM)))
+
+
+def test_participants_are_shared_between_processes(jams):
+    first, second = jams
+    alice, bob = User(id="alice", name="Alice", avatar=""), User(id="bob", name="Bob", avatar="")
+    asyncio.run(first.add_participant(JAM, "first:1", alice))
+    asyncio.run(second.add_participant(JAM, "second:1", bob))
+
+    assert participant_ids(first) == participant_ids(second) == ["alice", "bob"]
+
+    asyncio.run(second.remove_participant(JAM, "second:1"))
+
+    assert participant_ids(first) == ["alice"]
+
+
+def test_participant_stays_until_the_last_socket_leaves(jams):
+    first, second = jams
+    alice = User(id="alice", name="Alice", avatar="")
+    asyncio.run(first.add_participant(JAM, "first:1", alice))
+    asyncio.run(second.add_participant(JAM, "second:1", alice))
+
+    assert participant_ids(first) == ["alice"]
+
+    asyncio.run(first.remove_participant(JAM, "first:1"))
+    assert participant_ids(first) == ["alice"]
+
+    asyncio.run(second.remove_participant(JAM, "second:1"))
+    assert participant_ids(first) == []
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+
+from interfaces.queue import PROGRESS_CHANNEL_PREFIX
+from managers.pubsub import PubSubManager
+
+
+@pytest.fixture
+def manager():
+    # Not the process-wide instance, its clients only connect when used.
+    manager = object.__new__(PubSubManager)
+    manager._initialize_manager()
+    return manager
+
+
+def progress(track_id: str, value: float) -> tuple[str, str]:
+    message = {"type": "progress", "data": {"id": track_id, "status": "separating",
+                                            "value": value}}
+    return PROGRESS_CHANNEL_PREFIX + track_id, json.dumps(message)
+
+
+def test_flush_tasks_are_kept_until_done(manager):
+    delivered = []
+
+    async def run():
+        manager._progress_listeners.append(delivered.append)
+        manager._dispatch_progress(*progress("a", 10))
+        assert len(manager._tasks) == 1
+        await asyncio.gather(*manager._tasks)
+
+    asyncio.run(run())
+
+    assert [message["data"]["value"] for message in delivered] == [10]
+    assert not manager._tasks
+
+
+def test_close_cancels_pending_flushes(manager):
+    async def run():
+        never_set = asyncio.Event()
+
+        async def callback(message):
+            await never_set.wait()
+
+        manager._progress_callbacks["a"] = [callback]
+        manager._dispatch_progress(*progress("a", 10))
+        task, = manager._tasks
+        await asyncio.sleep(0)
+
+        await manager.close()
+
+        assert task.cancelled()
+        assert not manager._tasks and not manager._flushing
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import interfaces.queue as queue_module
+from interfaces.queue import AsyncRedisQueueInterface
+from models.track import Track
+
+ROOM = "room-1"
+LEGACY_KEY = f"room:{ROOM}:queue"
+
+
+def store_legacy_queue(interface: AsyncRedisQueueInterface, tracks: list[Track]):
+    asyncio.run(interface.redis.rpush(
+        LEGACY_KEY, *[json.dumps(track.model_dump()) for track in tracks]))
+
+
+def test_legacy_list_is_migrated_in_order(interface, make_track):
+    tracks = [make_track("b", time_added=1), make_track("a", time_added=2, status="ready"),
+              make_track("b", time_added=3)]
+    store_legacy_queue(interface, tracks)
+
+    queue = asyncio.run(interface.get_queue(ROOM))
+
+    assert [(track.id, track.time_added) for track in queue] == [("b", 1), ("a", 2), ("b", 3)]
+    assert queue[1].status == "ready"
+    assert not asyncio.run(interface.redis.exists(LEGACY_KEY))
+
+
+def test_migrated_queue_can_be_edited(interface, make_track):
+    store_legacy_queue(interface, [make_track("a", time_added=1), make_track("b", time_added=2)])
+
+    asyncio.run(interface.add_track_to_queue(ROOM, make_track("c", time_added=0)))
+    asyncio.run(interface.move_track(ROOM, 2, 0))
+    removed = asyncio.run(interface.remove_track_from_queue(ROOM, make_track("a", time_added=1)))
+
+    assert removed is not None and removed["id"] == "a"
+    assert [track.id for track in asyncio.run(interface.get_queue(ROOM))] == ["c", "b"]
+
+
+def test_room_is_only_checked_once_per_process(interface, make_track):
+    asyncio.run(interface.get_queue(ROOM))
+    assert ROOM in queue_module._migrated_rooms
+    # A list showing up afterwards is left alone, the queue is not read from it.
+    store_legacy_queue(interface, [make_track("a", time_added=1)])
+
+    assert asyncio.run(interface.get_queue(ROOM)) == []
+    assert asyncio.run(interface.redis.exists(LEGACY_KEY))
+
+
+def test_migration_without_legacy_queue(interface, make_track):
+    asyncio.run(interface.add_track_to_queue(ROOM, make_track("a", time_added=0)))
+
+    assert [track.id for track in asyncio.run(interface.get_queue(ROOM))] == ["a"]
+
+
+def test_migration_retries_when_the_list_changes(interface, make_track, monkeypatch):
+    store_legacy_queue(interface, [make_track("a", time_added=1)])
+    pipeline_class = type(interface.redis.pipeline())
+    lrange = pipeline_class.lrange
+    edited = []
+
+    async def lrange_then_edit(pipe, *args, **kwargs):
+        result = await lrange(pipe, *args, **kwargs)
+        if not edited:
+            # Another process appends to the list between the read and the transaction.
+            edited.append(True)
+            await interface.redis.rpush(LEGACY_KEY, json.dumps(
+                make_track("b", time_added=2).model_dump()))
+        return result
+
+    monkeypatch.setattr(pipeline_class, "lrange", lrange_then_edit)
+
+    queue = asyncio.run(interface.get_queue(ROOM))
+
+    assert [track.id for track in queue] == ["a", "b"]
+    assert not asyncio.run(interface.redis.exists(LEGACY_KEY))
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from interfaces.queue import AsyncRedisQueueInterface
+from models.track import Track
+
+ROOM = "room-1"
+
+
+def queue_ids(interface: AsyncRedisQueueInterface) -> list[str]:
+    return [track.id for track in asyncio.run(interface.get_queue(ROOM))]
+
+
+@pytest.fixture
+def fill(interface, make_track):
+    def fill_queue(*track_ids: str) -> list[Track]:
+        tracks = [make_track(track_id) for track_id in track_ids]
+        for track in tracks:
+            asyncio.run(interface.add_track_to_queue(ROOM, track))
+        return tracks
+    return fill_queue
+
+
+def test_add_track_appends_and_returns_length(interface, make_track):
+    assert asyncio.run(interface.add_track_to_queue(ROOM, make_track("a"))) == 1
+    assert asyncio.run(interface.add_track_to_queue(ROOM, make_track("b"))) == 2
+    assert queue_ids(interface) == ["a", "b"]
+
+
+def test_same_track_can_be_queued_twice(interface, fill):
+    fill("a", "a")
+    assert queue_ids(interface) == ["a", "a"]
+
+
+def test_add_to_next_inserts_after_current(interface, fill, make_track):
+    fill("a", "b", "c")
+    asyncio.run(interface.redis.set(f"room:{ROOM}:queue:current_idx", 1))
+
+    idx = asyncio.run(interface.add_track_to_next(ROOM, make_track("d")))
+
+    assert idx == 2
+    assert queue_ids(interface) == ["a", "b", "d", "c"]
+
+
+def test_add_to_next_on_empty_queue(interface, make_track):
+    idx = asyncio.run(interface.add_track_to_next(ROOM, make_track("a")))
+
+    assert idx == 0
+    assert queue_ids(interface) == ["a"]
+
+
+def test_add_to_next_without_current_index(interface, fill, make_track):
+    fill("a", "b")
+
+    assert asyncio.run(interface.add_track_to_next(ROOM, make_track("c"))) == 1
+    assert queue_ids(interface) == ["a", "c", "b"]
+
+
+@pytest.mark.parametrize("old_idx, new_idx", [(0, 2), (2, 0), (1, 3), (3, 1), (0, -1)])
+def test_move_track_matches_list_semantics(interface, fill, old_idx, new_idx):
+    fill("a", "b", "c", "d")
+    expected = ["a", "b", "c", "d"]
+    expected.insert(new_idx, expected.pop(old_idx))
+
+    moved = asyncio.run(interface.move_track(ROOM, old_idx, new_idx))
+
+    assert moved is not None and moved.id == ["a", "b", "c", "d"][old_idx]
+    assert queue_ids(interface) == expected
+
+
+def test_move_track_out_of_range(interface, fill):
+    fill("a")
+    assert asyncio.run(interface.move_track(ROOM, 5, 0)) is None
+    assert queue_ids(interface) == ["a"]
+
+
+def test_repeated_inserts_between_neighbours_keep_order(interface, fill, make_track):
+    # Each insertion halves the gap between two scores, until they are spread again.
+    fill("a", "z")
+    expected = ["a", "z"]
+    for i in range(80):
+        asyncio.run(interface.add_track_to_queue(ROOM, make_track(f"t{i}")))
+        asyncio.run(interface.move_track(ROOM, len(expected), 1))
+        expected.insert(1, f"t{i}")
+    assert queue_ids(interface) == expected
+
+
+def test_remove_track_returns_entry_with_status(interface, fill):
+    a, b = fill("a", "b")
+    a.status, a.progress = "processing", 50.
+    asyncio.run(interface.update_track_status(ROOM, a))
+
+    removed = asyncio.run(interface.remove_track_from_queue(ROOM, a))
+
+    assert removed is not None
+    assert removed["id"] == "a"
+    assert removed["status"] == "processing"
+    assert removed["progress"] == 50.
+    assert queue_ids(interface) == ["b"]
+    assert asyncio.run(interface.remove_track_from_queue(ROOM, a)) is None
+
+
+def test_update_status_overrides_queued_track(interface, fill):
+    a, = fill("a")
+    a.status, a.progress = "ready", 100.
+
+    asyncio.run(interface.update_track_status(ROOM, a))
+
+    track, = asyncio.run(interface.get_queue(ROOM))
+    assert (track.status, track.progress) == ("ready", 100.)
+
+
+def test_update_status_ignores_removed_entry(interface, fill):
+    a, = fill("a")
+    asyncio.run(interface.remove_track_from_queue(ROOM, a))
+    a.status = "ready"
+
+    asyncio.run(interface.update_track_status(ROOM, a))
+
+    assert asyncio.run(interface.redis.hlen(f"room:{ROOM}:queue:status")) == 0
+
+
+def test_clear_queue_keeps_played_and_current(interface, fill):
+    fill("a", "b", "c", "d")
+    asyncio.run(interface.redis.set(f"room:{ROOM}:queue:current_idx", 1))
+
+    asyncio.run(interface.clear_queue(ROOM))
+
+    assert queue_ids(interface) == ["a", "b"]
+    assert asyncio.run(interface.redis.hlen(f"room:{ROOM}:queue:tracks")) == 2
+
+
+def test_set_queue_replaces_everything(interface, fill, make_track):
+    fill("a", "b")
+
+    asyncio.run(interface.set_queue(ROOM, [make_track("c"), make_track("d")]))
+
+    assert queue_ids(interface) == ["c", "d"]
+
+
+def test_empty_queue(interface):
+    assert asyncio.run(interface.get_queue(ROOM)) == []
@@ -1,10 +1,12 @@
 import threading
 import redis
+import redis.asyncio as aioredis
 
 class DatabaseManager:
     _instance = None
     _lock = threading.Lock()
     _redis_pool = None  # To store the Redis connection pool
+    _async_redis_pool = None  # Pool of the asyncio clients, used by the async routes
 
     def __new__(cls, **kwargs):
         if cls._instance is None:
@@ -20,6 +22,8 @@ class DatabaseManager:
         Initializes the Redis connection pool.
         Additional kwargs can be passed for more redis.ConnectionPool options.
         """
+        self._connection_kwargs = dict(host=host, port=port, db=db, password=password,
+                                       decode_responses=True, **kwargs)
         if DatabaseManager._redis_pool is None:
             try:
                 print(f"Initializing Redis connection pool to host='{host}', port={port}, db={db}")
@@ -60,6 +64,16 @@ class DatabaseManager:
         # Each call to redis.Redis with a connection_pool gets a connection from the pool
         return redis.Redis(connection_pool=DatabaseManager._redis_pool)
 
+    def get_async_session(self):
+        """
+        Returns an asyncio Redis client sharing the async connection pool. Commands
+        must be awaited, they don't block the event loop.
+        """
+        if DatabaseManager._async_redis_pool is None:
+            # Connections are opened lazily, on the event loop that uses them.
+            DatabaseManager._async_redis_pool = aioredis.ConnectionPool(**self._connection_kwargs)
+        return aioredis.Redis(connection_pool=DatabaseManager._async_redis_pool)
+
     def get_connection_pool(self):
         """
         Returns the underlying connection pool itself, if direct access is needed.
@@ -73,3 +87,10 @@ def get_db():
     db_manager = DatabaseManager()  # Ensure the manager is initialized
     return db_manager.get_session()
 
+
+def get_async_db():
+    """
+    Provides an asyncio Redis client, for the `async def` routes.
+    """
+    db_manager = DatabaseManager()
+    return db_manager.get_async_session()
@@ -0,0 +1,197 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import torch as th
+from torch import nn
+
+from services.demucs.apply import BagOfModels
+from services.demucs.export import ExportedModel, export_model
+from services.demucs.htdemucs import HTDemucs
+from services.demucs.pretrained import checkpoint_signature, get_model
+from utils import STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("float32", "int8")
+MODELS_DIR = os.path.join(STORAGE_DIR, "models")
+
+
+def artifact_name(name: str) -> str:
+    """
+    Name of the files derived from a pretrained model, which changes with its checkpoint
+    and the torch version they were produced with.
+    """
+    return f"{name}-{checkpoint_signature(name)}-torch{th.__version__}"
+
+
+def get_device(precision: str = "float32") -> str:
+    """
+    Returns the best available torch device for separation. Dynamically quantized
+    models only run on CPU.
+    """
+    if precision == "int8":
+        return "cpu"
+    if th.cuda.is_available():
+        return "cuda"
+    elif th.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+class ModelManager:
+    """
+    Process-wide registry of warmed separation models.
+
+    Models are keyed by (model name, device, segment, precision) and loaded at most
+    once per process, so every separation after the first one skips checkpoint
+    deserialization, `model.to(device)` and `model.eval()`.
+
+    With precision "int8", the linear layers (most of the transformer in HTDemucs) are
+    dynamically quantized when the model is loaded, see `scripts/check_quantized.py`
+    for their quality.
+
+    `export` compiles the forward pass of a loaded model for the chunk shape used by
+    `apply_model`, see `services.demucs.export`.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(ModelManager, cls).__new__(
+                        cls, *args, **kwargs)
+                    cls._instance._initialize_manager()
+        return cls._instance
+
+    def _initialize_manager(self):
+        self._models: dict[tuple[str, str, Optional[float], str], Any] = {}
+        self._load_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_times: dict[str, float] = {}
+
+    def get_model(self, name: str = "htdemucs", device: Optional[str] = None,
+                  segment: Optional[float] = None, precision: str = "float32") -> Any:
+        """
+        Returns the model for the given key, loading it on the first request.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, must be one of {PRECISIONS}")
+        if precision == "int8" and device not in (None, "cpu"):
+            raise ValueError("int8 models only run on cpu")
+        device = device or get_device(precision)
+        key = (name, device, segment, precision)
+        model = self._models.get(key)
+        if model is not None:
+            self.hits += 1
+            return model
+        with self._load_lock:
+            # Another thread may have loaded the model while we were waiting.
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+            self.misses += 1
+            start = time.perf_counter()
+            if precision == "int8":
+                model = self._load_quantized(name, segment)
+            else:
+                model = self._load(name, device, segment)
+            elapsed = time.perf_counter() - start
+            self._models[key] = model
+            self.load_times[self._format_key(key)] = elapsed
+            logger.debug("Loaded model %s (%s) on %s in %.2fs", name, precision, device,
+                         elapsed)
+            return model
+
+    def _load(self, name: str, device: str, segment: Optional[float]) -> Any:
+        model: Any = get_model(name=name)
+        if isinstance(model, BagOfModels) and len(model.models) == 1:
+            # A bag holding a single model is equivalent to that model (the weights
+            # normalise out), unwrap it so `apply_model` takes the direct path.
+            model = model.models[0]
+        if isinstance(model, BagOfModels):
+            if segment is not None:
+                for sub in model.models:
+                    sub.segment = segment
+        elif segment is not None:
+            model.segment = segment
+        model.to(device)
+        model.eval()
+        return model
+
+    def _load_quantized(self, name: str, segment: Optional[float]) -> Any:
+        # The int8 weights are not saved: loading them needs the quantized modules,
+        # which are built by quantizing the float model, giving the same weights.
+        model = self._load(name, "cpu", None)
+        model = th.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=th.qint8)
+        if segment is not None:
+            for sub in getattr(model, "models", [model]):
+                sub.segment = segment
+        model.eval()
+        return model
+
+    def warmup(self, name: str = "htdemucs", device: Optional[str] = None,
+               segment: Optional[float] = None, precision: str = "float32") -> None:
+        """
+        Loads the model ahead of the first request, e.g. when a worker starts.
+        """
+        self.get_model(name, device, segment, precision)
+
+    def export(self, name: str = "htdemucs", device: Optional[str] = None,
+               segment: Optional[float] = None, batch: int = 1,
+               stem: Optional[str] = "vocals") -> Optional[ExportedModel]:
+        """
+        Attaches a compiled forward to the float32 model for chunks of `batch` segments,
+        building it on the first call and loading it from `MODELS_DIR` afterwards.
+        Returns None if the model is not supported (bags, other architectures, mps).
+        """
+        device = device or get_device()
+        model = self.get_model(name, device, segment)
+        if not isinstance(model, HTDemucs) or device == "mps":
+            # HTDemucs moves its tensors to the cpu for complex ops on mps.
+            return None
+        exported = getattr(model, "exported", None)
+        if exported is not None:
+            return exported
+        with self._load_lock:
+            # Another thread may have compiled the model while we were waiting.
+            exported = getattr(model, "exported", None)
+            if exported is not None:
+                return exported
+            start = time.perf_counter()
+            length = int(model.segment * model.samplerate)
+            index = None if stem is None else model.sources.index(stem)
+            exported = export_model(model, artifact_name(name), length, batch, device,
+                                    MODELS_DIR, index)
+            elapsed = time.perf_counter() - start
+            self.load_times[f"{self._format_key((name, device, segment, 'float32'))}"
+                            f":{exported.kind}"] = elapsed
+            logger.debug("Compiled model %s on %s with %s for %s in %.2fs", name, device,
+                         exported.kind, exported.shape, elapsed)
+            return exported
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns cache statistics: hit/miss counts and load time (seconds) per key.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "loaded": [self._format_key(key) for key in self._models],
+            "load_times": dict(self.load_times),
+        }
+
+    @staticmethod
+    def _format_key(key: tuple[str, str, Optional[float], str]) -> str:
+        name, device, segment, precision = key
+        return f"{name}:{device}:{segment}:{precision}"
+
+
+def get_model_manager():
+    return ModelManager()
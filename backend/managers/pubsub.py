@@ -0,0 +1,244 @@
+import asyncio
+import inspect
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+import redis
+import redis.asyncio as aioredis
+
+from interfaces.queue import PROGRESS_CHANNEL_PREFIX
+
+# Prefix of the messages published by this manager: the 32 hex chars of the
+# publishing process' origin id, followed by the payload.
+ORIGIN_LENGTH = 32
+
+# Last statuses published for a track, and how long a track is watched without one.
+TERMINAL_STATUSES = {"ready", "error"}
+PROGRESS_WATCH_TIMEOUT = float(os.getenv("PROGRESS_WATCH_TIMEOUT", 3600))
+
+
+def _is_progress_tick(message: dict) -> bool:
+    """Separation progress update, which can be replaced by a later one."""
+    data = message.get("data", {})
+    return data.get("status") == "separating" and "value" in data and "playable" not in data
+
+
+class PubSubManager:
+    """
+    Redis pub/sub bus shared by every API process, so WebSocket messages reach the
+    sockets connected to other uvicorn workers or nodes.
+
+    Each process holds a single subscriber connection and subscribes once per
+    channel it has local listeners for (e.g. once per room with local sockets).
+    Messages are tagged with the id of the process that published them, so a
+    process skips its own messages, which it already delivered locally.
+
+    It also listens to the progress of the tracks being processed by the workers,
+    with a single pattern subscription to `progress:*`, see `add_progress_listener`
+    and `watch_progress`.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(PubSubManager, cls).__new__(
+                        cls, *args, **kwargs)
+                    cls._instance._initialize_manager()
+        return cls._instance
+
+    def _initialize_manager(self):
+        self.origin = uuid.uuid4().hex
+        self.redis = aioredis.Redis(host=os.getenv("REDIS_HOST", "localhost"),
+                                    port=int(os.getenv("REDIS_PORT", 6379)),
+                                    decode_responses=True)
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._pattern_handlers: Dict[str, Callable[[str, str], None]] = {}
+        self._reader: Optional[asyncio.Task] = None
+        self._progress_callbacks: Dict[str, List[Callable[[dict], Any]]] = {}
+        self._progress_listeners: List[Callable[[dict], None]] = []
+        self._progress_timeouts: Dict[str, asyncio.TimerHandle] = {}
+        self._pending_progress: Dict[str, Deque[dict]] = {}
+        self._flushing: Set[str] = set()
+        # Running `_flush_progress` tasks, the event loop only keeps weak references.
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def subscribe(self, channel: str, handler: Callable[[str], None]):
+        """
+        Call `handler(payload)` for every message published on `channel` by another
+        process. Replaces the previous handler of the channel.
+        """
+        new = channel not in self._handlers
+        self._handlers[channel] = handler
+        if new:
+            await self._pubsub.subscribe(channel)
+        self._start_reader()
+
+    async def unsubscribe(self, channel: str):
+        if self._handlers.pop(channel, None) is not None:
+            await self._pubsub.unsubscribe(channel)
+
+    async def psubscribe(self, pattern: str, handler: Callable[[str, str], None]):
+        """
+        Call `handler(channel, data)` for every message published on a channel matching
+        `pattern`. Unlike `subscribe`, messages are not expected to come from this manager,
+        they are passed as published.
+        """
+        new = pattern not in self._pattern_handlers
+        self._pattern_handlers[pattern] = handler
+        if new:
+            await self._pubsub.psubscribe(pattern)
+        self._start_reader()
+
+    async def add_progress_listener(self, listener: Callable[[dict], None]):
+        """
+        Call `listener(message)` with the progress messages of every track. Each API
+        process delivers them to its own sockets, so every client gets each update once.
+        """
+        if listener not in self._progress_listeners:
+            self._progress_listeners.append(listener)
+        await self.psubscribe(f"{PROGRESS_CHANNEL_PREFIX}*", self._dispatch_progress)
+
+    async def watch_progress(self, track_id: str, callback: Callable[[dict], Any]):
+        """
+        Call `callback(message)` with the decoded progress messages of the track, until
+        its "ready" or "error" status, or PROGRESS_WATCH_TIMEOUT seconds without one.
+        Coroutine callbacks are awaited one message at a time, and the progress updates
+        received meanwhile are coalesced into the latest one.
+        """
+        self._progress_callbacks.setdefault(track_id, []).append(callback)
+        timeout = self._progress_timeouts.pop(track_id, None)
+        if timeout is not None:
+            timeout.cancel()
+        self._progress_timeouts[track_id] = asyncio.get_running_loop().call_later(
+            PROGRESS_WATCH_TIMEOUT, self._forget_progress, track_id)
+        await self.psubscribe(f"{PROGRESS_CHANNEL_PREFIX}*", self._dispatch_progress)
+
+    def _forget_progress(self, track_id: str):
+        self._progress_callbacks.pop(track_id, None)
+        timeout = self._progress_timeouts.pop(track_id, None)
+        if timeout is not None:
+            timeout.cancel()
+
+    def _dispatch_progress(self, channel: str, data: str):
+        track_id = channel[len(PROGRESS_CHANNEL_PREFIX):]
+        if track_id not in self._progress_callbacks and not self._progress_listeners:
+            return
+        message = json.loads(data)
+        pending = self._pending_progress.setdefault(track_id, deque())
+        if pending and _is_progress_tick(pending[-1]) and _is_progress_tick(message):
+            # Only the latest value matters to the clients.
+            pending[-1] = message
+        else:
+            pending.append(message)
+        if track_id not in self._flushing:
+            self._flushing.add(track_id)
+            task = asyncio.ensure_future(self._flush_progress(track_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush_progress(self, track_id: str):
+        pending = self._pending_progress[track_id]
+        try:
+            while pending:
+                message = pending.popleft()
+                callbacks = self._progress_callbacks.get(track_id, [])
+                if message.get("data", {}).get("status") in TERMINAL_STATUSES:
+                    # Last message for the track, forget about it.
+                    self._forget_progress(track_id)
+                for listener in self._progress_listeners:
+                    try:
+                        listener(message)
+                    except Exception as e:
+                        print(f"Error delivering progress of track {track_id}: {e}")
+                for callback in callbacks:
+                    try:
+                        result = callback(message)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        print(f"Error processing progress of track {track_id}: {e}")
+        finally:
+            self._flushing.discard(track_id)
+            del self._pending_progress[track_id]
+
+    async def close(self):
+        """
+        Stop reading and delivering messages, and close the connections to Redis.
+        """
+        self._handlers.clear()
+        self._pattern_handlers.clear()
+        for track_id in list(self._progress_timeouts):
+            self._forget_progress(track_id)
+        tasks = [*self._tasks, *([self._reader] if self._reader is not None else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._reader = None
+        try:
+            await self._pubsub.aclose()
+            await self.redis.aclose()
+        except redis.RedisError as e:
+            print(f"Error closing pub/sub connections: {e}")
+
+    def _start_reader(self):
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+
+    def _subscribed(self) -> bool:
+        return bool(self._handlers or self._pattern_handlers)
+
+    async def publish(self, channel: str, payload: str):
+        try:
+            await self.redis.publish(channel, self.origin + payload)
+        except redis.RedisError as e:
+            print(f"Error publishing message on channel {channel}: {e}")
+
+    async def _read(self):
+        while self._subscribed():
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except redis.RedisError as e:
+                print(f"Error reading from pub/sub, resubscribing: {e}")
+                await asyncio.sleep(1)
+                try:
+                    await self._pubsub.reset()
+                    if self._handlers:
+                        await self._pubsub.subscribe(*self._handlers)
+                    if self._pattern_handlers:
+                        await self._pubsub.psubscribe(*self._pattern_handlers)
+                except redis.RedisError:
+                    pass
+                continue
+            if message is None:
+                continue
+            if message["type"] == "pmessage":
+                pattern_handler = self._pattern_handlers.get(message["pattern"])
+                if pattern_handler is not None:
+                    try:
+                        pattern_handler(message["channel"], message["data"])
+                    except Exception as e:
+                        print(f"Error processing message on channel {message['channel']}: {e}")
+                continue
+            if message["type"] != "message":
+                continue
+            data: str = message["data"]
+            if data[:ORIGIN_LENGTH] == self.origin:
+                continue
+            handler = self._handlers.get(message["channel"])
+            if handler is None:
+                continue
+            try:
+                handler(data[ORIGIN_LENGTH:])
+            except Exception as e:
+                print(f"Error processing message on channel {message['channel']}: {e}")
+
+
+def get_pubsub():
+    return PubSubManager()
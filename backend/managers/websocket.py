@@ -1,23 +1,99 @@
 import asyncio
+from collections import deque
+from contextlib import suppress
+import statistics
 import threading
+import time
 import uuid
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List
+from typing import Any, Callable, Deque, Dict, List, Optional
 
 from fastapi.websockets import WebSocketState
 
 from models.user import User
-from managers.redis import get_redis
-from interfaces.jam import RedisJamInterface
-from middlewares.format import convert_keys
+from managers.pubsub import get_pubsub
+from middlewares.format import dumps_camel
 import services.jam as jam
 
 
+# Messages a client can be behind before it is disconnected.
+OUTBOUND_QUEUE_SIZE = 64
+# A single send taking longer than this (seconds) also disconnects the client.
+SEND_TIMEOUT = 5.0
+# Close code sent to clients that can't keep up, they are expected to reconnect.
+LAGGING_CLOSE_CODE = 1013
+# Pub/sub channels relaying messages to the sockets of the other API processes.
+BROADCAST_CHANNEL = "ws:broadcast"
+
+
+def room_channel(room_id: str) -> str:
+    return f"ws:room:{room_id}"
+
+
+class OutboundQueue:
+    """
+    Messages waiting to be sent to one socket, drained by a task of its own so a slow
+    client only delays itself and not the rest of the room.
+    """
+
+    def __init__(self, websocket: WebSocket, on_sent: Callable[[float], None],
+                 maxsize: int = OUTBOUND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.closed = False
+        self._on_sent = on_sent
+        self._queue: asyncio.Queue[tuple[str, float]] = asyncio.Queue(maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, message: str, created: float) -> bool:
+        """Queue a serialised message, returns False if the client is lagging."""
+        if self.closed:
+            return True
+        try:
+            self._queue.put_nowait((message, created))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _run(self):
+        try:
+            while True:
+                message, created = await self._queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), SEND_TIMEOUT)
+                self._on_sent(time.perf_counter() - created)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Disconnecting client", self.websocket.client, "after failed send:", e)
+            await self._close_socket()
+
+    async def close(self, code: int = 1000):
+        """Stop sending and close the socket."""
+        self._task.cancel()
+        await self._close_socket(code)
+
+    def drop(self, code: int = LAGGING_CLOSE_CODE):
+        """Like `close`, without waiting: the socket is closed by the task of the queue."""
+        if self.closed:
+            return
+        self._task.cancel()
+        self._task = asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int = LAGGING_CLOSE_CODE):
+        if self.closed:
+            return
+        self.closed = True
+        with suppress(Exception):
+            await self.websocket.close(code)
+
+    def cancel(self):
+        self.closed = True
+        self._task.cancel()
+
+
 class WebSocketManager:
     _instance = None
     _lock = threading.Lock()
     rooms: Dict[str, list[tuple[User, WebSocket]]] = {}
-    _send_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -32,7 +108,12 @@ class WebSocketManager:
         self.service_id = uuid.uuid4()
         self.connected_clients: List[WebSocket] = []
         self.queue: List[dict] = []
-        self.jam_interface = RedisJamInterface(get_redis())
+        self.jam_interface = jam.interface
+        self.outbound: Dict[WebSocket, OutboundQueue] = {}
+        # Time from multicast/broadcast to the message being sent, per recipient.
+        self.latencies: Deque[float] = deque(maxlen=2000)
+        self.dropped = 0
+        self.pubsub = get_pubsub()
 
     def add_client(self, websocket):
         print("New client connected:", websocket.client)
@@ -44,12 +125,59 @@ class WebSocketManager:
     async def connect(self, client: WebSocket):
         await client.accept()
         self.connected_clients.append(client)
+        self.outbound[client] = OutboundQueue(client, self.latencies.append)
+        await self.pubsub.subscribe(BROADCAST_CHANNEL, self._deliver_broadcast)
+        await self.pubsub.add_progress_listener(self._deliver_progress)
+
+    def release(self, client: WebSocket):
+        outbound = self.outbound.pop(client, None)
+        if outbound is not None:
+            outbound.cancel()
+
+    def send(self, client: WebSocket, message: str, created: Optional[float] = None):
+        """
+        Queue a serialised message for the client without waiting for it to be sent.
+        Clients more than `OUTBOUND_QUEUE_SIZE` messages behind are disconnected.
+        """
+        outbound = self.outbound.get(client)
+        if outbound is None or client.client_state == WebSocketState.DISCONNECTED:
+            return
+        if not outbound.put(message, created or time.perf_counter()):
+            self.dropped += 1
+            print("Disconnecting lagging client:", client.client)
+            outbound.drop(LAGGING_CLOSE_CODE)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns fan-out latency percentiles (ms) over the last sends, and the number of
+        clients dropped for lagging.
+        """
+        stats: dict[str, Any] = {
+            "clients": len(self.outbound),
+            "rooms": len(self.rooms),
+            "dropped": self.dropped,
+            "samples": len(self.latencies),
+        }
+        if len(self.latencies) >= 2:
+            percentiles = statistics.quantiles(self.latencies, n=100)
+            for p in (50, 95, 99):
+                stats[f"p{p}_ms"] = percentiles[p - 1] * 1000
+        return stats
+
+    def connection_id(self, client: WebSocket) -> str:
+        """Identifies the socket among the sockets of all the API processes."""
+        return f"{self.service_id}:{id(client)}"
 
     async def disconnect(self, client: WebSocket, room_id: str, user: User):
         if room_id in self.rooms:
             self.rooms[room_id] = [
                 (uid, ws) for (uid, ws) in self.rooms[room_id] if ws != client
             ]
+            if not self.rooms[room_id]:
+                # No local socket left in the room, stop relaying it to this process.
+                del self.rooms[room_id]
+                await self.pubsub.unsubscribe(room_channel(room_id))
+        await self.jam_interface.remove_participant(room_id, self.connection_id(client))
         await self.multicast(room_id, {
             "type": "jam",
             "action": "left",
@@ -59,35 +187,33 @@ class WebSocketManager:
         })
 
     async def multicast(self, roomId, data, *, socket=None):
-        with self._send_lock:
-            data = convert_keys(data)
-            disconnected_clients = []
-            connections = self.rooms.get(roomId, [])
-            for (_, connection) in connections:
-                if connection.client_state == WebSocketState.DISCONNECTED:
-                    disconnected_clients.append(connection)
-                    continue
-                if connection == socket:
-                    continue
-                try:
-                    await connection.send_json(data)
-                except Exception:
-                    disconnected_clients.append(connection)
+        # Serialise once for the whole room, then hand the text over to each socket's
+        # queue. Nothing is awaited, so a slow client can't stall the others.
+        message = dumps_camel(data)
+        self._deliver_room(roomId, message, socket=socket)
+        # Sockets of the room connected to other processes.
+        await self.pubsub.publish(room_channel(roomId), message)
 
     async def broadcast(self, data):
-        with self._send_lock:
-            data = convert_keys(data)
-            disconnected_clients = []
-            for client in self.connected_clients:
-                if client.client_state == WebSocketState.DISCONNECTED:
-                    disconnected_clients.append(client)
-                    continue
-                try:
-                    await client.send_json(data)
-                except Exception as e:
-                    disconnected_clients.append(client)
-            for client in disconnected_clients:
-                self.connected_clients.remove(client)
+        message = dumps_camel(data)
+        self._deliver_broadcast(message)
+        await self.pubsub.publish(BROADCAST_CHANNEL, message)
+
+    def _deliver_room(self, room_id: str, message: str, *, socket=None):
+        created = time.perf_counter()
+        for (_, connection) in self.rooms.get(room_id, []):
+            if connection != socket:
+                self.send(connection, message, created)
+
+    def _deliver_progress(self, message: dict):
+        # Every process gets the progress from the workers, so it is only delivered
+        # locally, not relayed through the broadcast channel.
+        self._deliver_broadcast(dumps_camel(message))
+
+    def _deliver_broadcast(self, message: str):
+        created = time.perf_counter()
+        for client in self.connected_clients:
+            self.send(client, message, created)
 
     async def websocket_endpoint(self, websocket: WebSocket):
         await self.connect(websocket)
@@ -106,10 +232,13 @@ class WebSocketManager:
                 elif msg_type == "jam":
                     await self.handle_jam_message(websocket, msg)
         except WebSocketDisconnect:
+            pass
+        finally:
+            self.release(websocket)
+            if websocket in self.connected_clients:
+                self.connected_clients.remove(websocket)
             if user and room_id:
                 await self.disconnect(websocket, room_id, user)
-            elif websocket in self.connected_clients:
-                self.connected_clients.remove(websocket)
 
     async def handle_join_message(self, socket: WebSocket, room_id: str, user: User):
         """
@@ -117,8 +246,13 @@ class WebSocketManager:
         """
         if room_id not in self.rooms:
             self.rooms[room_id] = []
+            await self.pubsub.subscribe(
+                room_channel(room_id),
+                lambda message: self._deliver_room(room_id, message))
         if socket not in self.rooms[room_id]:
             self.rooms[room_id].append((user, socket))
+        # The room can have sockets on other processes, its participants are in Redis.
+        await self.jam_interface.add_participant(room_id, self.connection_id(socket), user)
 
         await self.multicast(room_id, {
             "type": "jam",
@@ -137,6 +271,6 @@ class WebSocketManager:
             print("No roomId found in the message.")
             return
         # update the jam state in Redis
-        jam.handle_message(message)
+        await jam.handle_message(message)
         # Process the message and broadcast it to all connected clients
         await self.multicast(room_id, message, socket=socket)
@@ -1,44 +1,49 @@
 import json
-from typing import cast
-from fastapi import Request
-from fastapi.responses import JSONResponse, StreamingResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from functools import lru_cache
+from typing import Any
+from fastapi.responses import JSONResponse
 
 
-def to_camel(s: str) -> str:
+@lru_cache(maxsize=4096)
+def _to_camel(s: str) -> str:
     parts = s.split('_')
     return parts[0] + ''.join(word.capitalize() for word in parts[1:])
 
 
+def to_camel(s: str) -> str:
+    # Keys without underscores (already camelCase) are returned as is. The others come
+    # from a small set of field names, memoized.
+    if '_' not in s:
+        return s
+    return _to_camel(s)
+
+
 def convert_keys(obj):
     if isinstance(obj, list):
         return [convert_keys(i) for i in obj]
     if not isinstance(obj, dict):
         return obj
-    new_obj = {}
-    for k, v in obj.items():
-        new_key = to_camel(k)
-        new_obj[new_key] = convert_keys(v)
-    return new_obj
-
-
-class FormatReponseMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-
-        if response.headers.get('content-type') != 'application/json':
-            return response
-        stream_response = cast(StreamingResponse, response)
-
-        chunks = []
-        async for chunk in stream_response.body_iterator:
-            chunks.append(chunk)
-        response_body = b''.join(chunks)
-        try:
-            data = json.loads(response_body)
-            camel_data = convert_keys(data)
-            return JSONResponse(content=camel_data, status_code=response.status_code)
-        except Exception:
-            print(response)
-            # If it can't be JSON-decoded, just return the original response
-            return response
+    return {(to_camel(k) if isinstance(k, str) else k): convert_keys(v)
+            for k, v in obj.items()}
+
+
+def dumps_camel(obj) -> str:
+    """Serialise `obj` with camelCase keys, the same way `WebSocket.send_json` would."""
+    return json.dumps(convert_keys(obj), separators=(",", ":"), ensure_ascii=False)
+
+
+class CamelJSONResponse(JSONResponse):
+    """
+    JSON response with camelCase keys, converted while serialising. Set as the app's
+    default response class, so the body is encoded once instead of being decoded and
+    re-encoded by a middleware.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json.dumps(
+            convert_keys(content),
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
@@ -0,0 +1,126 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("dotenv")
+
+# The backend directory, so that the routes can be imported as the API does.
+sys.path.append(str(Path(__file__).parent.parent.parent))
+# utils creates the storage directories on import, keep them out of the tree.
+os.environ.setdefault("STORAGE_DIR", tempfile.mkdtemp())
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import utils
+from routes.track import (FALLBACK_CACHE_CONTROL, IMMUTABLE_CACHE_CONTROL, file_etag,
+                          router)
+
+
+@pytest.fixture
+def stems(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "NO_VOCALS_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_stem_is_immutable_with_etag(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+
+    response = client.get("/instrumental/song")
+
+    assert response.status_code == 200
+    assert response.content == b"mp3 data"
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["etag"] == file_etag(str(stems / "song.mp3"))
+
+
+def test_matching_etag_is_not_modified(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+    etag = client.get("/instrumental/song").headers["etag"]
+
+    response = client.get("/instrumental/song", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_if_none_match_lists_and_weak_tags(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+    etag = client.get("/instrumental/song").headers["etag"]
+
+    listed = client.get("/instrumental/song", headers={"If-None-Match": f'"other", W/{etag}'})
+    wildcard = client.get("/instrumental/song", headers={"If-None-Match": "*"})
+    stale = client.get("/instrumental/song", headers={"If-None-Match": '"other"'})
+
+    assert listed.status_code == 304
+    assert wildcard.status_code == 304
+    assert stale.status_code == 200
+    assert stale.content == b"mp3 data"
+
+
+def test_range_is_partial_content(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+
+    response = client.get("/instrumental/song", headers={"Range": "bytes=2-5"})
+
+    assert response.status_code == 206
+    assert response.content == b"3 da"
+    assert response.headers["content-range"] == f"bytes 2-5/{len(b'mp3 data')}"
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+
+
+def test_range_with_matching_etag_is_not_modified(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+    etag = client.get("/instrumental/song").headers["etag"]
+
+    response = client.get("/instrumental/song",
+                          headers={"Range": "bytes=2-5", "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert "content-range" not in response.headers
+
+
+def test_missing_variant_falls_back_to_mp3_briefly_cached(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+
+    response = client.get("/instrumental/song?format=aac")
+
+    assert response.status_code == 200
+    assert response.content == b"mp3 data"
+    assert response.headers["content-type"] == "audio/mpeg"
+    assert response.headers["cache-control"] == FALLBACK_CACHE_CONTROL
+
+
+def test_encoded_variant_is_immutable(stems, client):
+    (stems / "song.mp3").write_bytes(b"mp3 data")
+    (stems / "song.m4a").write_bytes(b"aac data")
+
+    response = client.get("/instrumental/song", headers={"Accept": "audio/mp4"})
+
+    assert response.status_code == 200
+    assert response.content == b"aac data"
+    assert response.headers["content-type"] == "audio/mp4"
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["vary"] == "Accept"
+
+
+def test_partial_stem_is_not_cached(stems, client):
+    (stems / "song.partial.mp3").write_bytes(b"partial")
+
+    response = client.get("/instrumental/song")
+
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-store"
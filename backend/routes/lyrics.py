@@ -4,7 +4,8 @@ from models.track import LyricsDelay
 from utils import get_lyrics_path
 from redis import RedisError
 import re
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import PlainTextResponse
+from middlewares.format import CamelJSONResponse
 from interfaces.queue import RedisQueueInterface
 from managers.db import get_db
 import cutlet
@@ -48,7 +49,7 @@ def get_lyrics(track_id: str,
                redis_interface: RedisQueueInterface = Depends(lambda: RedisQueueInterface(get_db())),):
     file_path = get_lyrics_path(track_id)
     if not file_path:
-        return JSONResponse(status_code=404, content={"error": "Lyrics not found"})
+        return CamelJSONResponse(status_code=404, content={"error": "Lyrics not found"})
     try:
         romanized_exists = redis_interface.check_romanized_lyrics(track_id)
         romanized_exists = False
@@ -95,16 +96,16 @@ def get_lyrics(track_id: str,
         if not romanized_exists and any(line is not None for line in romanized_lines):
             redis_interface.store_romanized_lyrics(track_id, romanized_lines)
 
-        return JSONResponse(content={"lyrics": lyrics, "content": "".join(raw_lines)}, status_code=200)
+        return CamelJSONResponse(content={"lyrics": lyrics, "content": "".join(raw_lines)}, status_code=200)
     except FileNotFoundError:
-        return JSONResponse(status_code=404, content={"error": "Lyrics not found"})
+        return CamelJSONResponse(status_code=404, content={"error": "Lyrics not found"})
 
 
 @router.get("/{track_id}/plain",)
 def get_plain_lyrics(track_id: str):
     file_path = get_lyrics_path(track_id)
     if not file_path:
-        return JSONResponse(status_code=404, content={"error": "Lyrics not found"})
+        return CamelJSONResponse(status_code=404, content={"error": "Lyrics not found"})
     with open(file_path, "r", encoding="utf-8") as f:
         plain_text = f.read()
     return PlainTextResponse(plain_text)
@@ -114,9 +115,9 @@ def get_plain_lyrics(track_id: str):
 def update_lyrics(track_id: str, data: dict):
     file_path = get_lyrics_path(track_id)
     if not file_path:
-        return JSONResponse(status_code=404, content={"error": "Lyrics not found"})
+        return CamelJSONResponse(status_code=404, content={"error": "Lyrics not found"})
     if "content" not in data:
-        return JSONResponse(status_code=400, content={"error": "Content not provided"})
+        return CamelJSONResponse(status_code=400, content={"error": "Content not provided"})
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(data["content"])
-    return JSONResponse(content={"message": "Lyrics updated successfully"})
+    return CamelJSONResponse(content={"message": "Lyrics updated successfully"})
@@ -1,11 +1,12 @@
-import asyncio
 import json
 import redis
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from interfaces.queue import RedisQueueInterface
+from fastapi.concurrency import run_in_threadpool
+from middlewares.format import CamelJSONResponse
+from interfaces.queue import AsyncRedisQueueInterface
 from managers.websocket import WebSocketManager
-from managers.db import get_db
+from managers.db import get_async_db
+from managers.pubsub import get_pubsub
 from models.track import Track
 import json
 from services.process_request import send_process_request, is_ready
@@ -20,8 +21,8 @@ ws_manager = WebSocketManager()
 async def reorder_queue_endpoint(
     room_id: str,
     new_order: dict,
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),
 ):
     """
     Reorder the queue for a specific room.
@@ -34,15 +35,12 @@ async def reorder_queue_endpoint(
         old_idx = new_order["oldIndex"]
         new_idx = new_order["newIndex"]
         user_id = new_order["id"]
-        tracks = redis_interface.get_queue(room_id)
-        element = tracks.pop(old_idx)
-        tracks.insert(new_idx, element)
-        redis_interface.set_queue(room_id, tracks)
+        await redis_interface.move_track(room_id, old_idx, new_idx)
         await ws_manager.multicast(room_id,
                                    {"type": "queue", "data": {"action": "reordered",
                                                               "old_idx": old_idx, "new_idx": new_idx, "id": user_id}}
                                    )
-        return JSONResponse(content={"message": "Queue reordered"}, status_code=200)
+        return CamelJSONResponse(content={"message": "Queue reordered"}, status_code=200)
     except redis.RedisError as e:
         raise HTTPException(status_code=500, detail=f"Redis error: {e}")
 
@@ -51,18 +49,18 @@ async def reorder_queue_endpoint(
 async def add_to_queue_endpoint(
     room_id: str,
     track: Track,
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),
 ):
     """
     Add a track to the room's queue.
     """
     try:
 
-        is_track_ready = is_ready(track)
+        is_track_ready = await run_in_threadpool(is_ready, track)
         track.status = "ready" if is_track_ready else "submitted"
         # Add the track to the user-specific queue, if track exists.
-        redis_interface.add_track_to_queue(
+        await redis_interface.add_track_to_queue(
             room_id, track)  # Use the new method
 
         await ws_manager.multicast(room_id,
@@ -71,13 +69,12 @@ async def add_to_queue_endpoint(
                                    )
 
         if is_track_ready:
-            return JSONResponse(content={"is_ready": True, "task": None}, status_code=200)
+            return CamelJSONResponse(content={"is_ready": True, "task": None}, status_code=200)
 
-        loop = asyncio.get_event_loop()
-
-        def process_message_callback(message_data: dict):
+        async def process_message_callback(message_data: dict):
             """
-            Callback to handle messages from the Redis pub/sub related to track processing.
+            Callback to store the processing status of the track in the room's queue. The
+            clients get the messages themselves from the WebSocket manager.
             """
             # "type": "notify",
             # "data": {
@@ -91,21 +88,24 @@ async def add_to_queue_endpoint(
             if message_type == "notify":
                 # Check if the message is for the current track
                 if message_data["data"]["track"]["id"] == track.id:
-                    track.status = message_data["data"]["status"]
+                    status = message_data["data"]["status"]
                     if "total" in message_data["data"]:
-                        track.progress = message_data["data"]["value"] / \
+                        progress = message_data["data"]["value"] / \
                             message_data["data"]["total"]
+                    elif status != track.status:
+                        progress = 0
                     else:
-                        track.progress = 0
-                    redis_interface.update_track_status(room_id, track)
-            asyncio.run_coroutine_threadsafe(ws_manager.broadcast(
-                message_data), loop)
+                        # e.g. the "playable" notice, nothing to store.
+                        progress = track.progress
+                    if status != track.status or progress != track.progress:
+                        track.status = status
+                        track.progress = progress
+                        await redis_interface.update_track_status(room_id, track)
 
-        redis_interface.subscribe_to_channel(
-            track.id, process_message_callback)
+        await get_pubsub().watch_progress(track.id, process_message_callback)
 
-        task = send_process_request(track)
-        return JSONResponse(content={"is_ready": False, "task": task.id}, status_code=200)
+        task = await run_in_threadpool(send_process_request, track)
+        return CamelJSONResponse(content={"is_ready": False, "task": task.id}, status_code=200)
 
     except redis.RedisError as e:
         raise HTTPException(status_code=500, detail=f"Redis error: {e}")
@@ -114,8 +114,8 @@ async def add_to_queue_endpoint(
 @router.get("/{room_id}/tracks")
 async def get_room_tracks(
     room_id: str,
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),
 ):
     """
     Retrieves all tracks from a specific room's queue.
@@ -127,14 +127,14 @@ async def get_room_tracks(
         A list of Track objects in the queue.
     """
     try:
-        # Use the get_queue method from RedisQueueInterface
-        tracks = redis_interface.get_queue(room_id)
+        # Use the get_queue method from AsyncRedisQueueInterface
+        tracks = await redis_interface.get_queue(room_id)
         key = f"room:{room_id}:queue:current_idx"
-        if not redis_interface.redis.exists(key):
+        if not await redis_interface.redis.exists(key):
             current_idx = 0
         else:
             current_idx = json.loads(
-                redis_interface.redis.get(key))  # type: ignore
+                await redis_interface.redis.get(key))  # type: ignore
         return {"tracks": tracks, "index": current_idx}
     except redis.RedisError as e:
         raise HTTPException(
@@ -146,19 +146,19 @@ async def get_room_tracks(
 async def remove_from_queue_endpoint(
     room_id: str,
     track: Track,
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),
 ):
     """
     Remove a track from the queue.
     """
     try:
-        res = redis_interface.remove_track_from_queue(room_id, track)
+        res = await redis_interface.remove_track_from_queue(room_id, track)
         await ws_manager.broadcast(
             {"type": "queue", "data": {
                 "action": "removed", "track": track.model_dump()}}
         )
-        return JSONResponse(content={"track": res}, status_code=200)
+        return CamelJSONResponse(content={"track": res}, status_code=200)
     except redis.RedisError as e:
         raise HTTPException(status_code=500, detail=f"Redis error: {e}")
 
@@ -168,8 +168,8 @@ async def remove_from_queue_endpoint(
 @router.post("/{room_id}/tracks/clear")
 async def clear_queue_endpoint(
     room_id: str,
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),
 ):
     """
     Removes all tracks from a room's queue.
@@ -178,11 +178,11 @@ async def clear_queue_endpoint(
         room_id: The ID of the room.
     """
     try:
-        redis_interface.clear_queue(room_id)  # Call the clear_queue method
+        await redis_interface.clear_queue(room_id)  # Call the clear_queue method
         await ws_manager.broadcast(
             {"type": "queue", "data": {"action": "cleared", "room_id": room_id}}
         )
-        return JSONResponse(content={"message": f"Queue for room {room_id} cleared"}, status_code=200)
+        return CamelJSONResponse(content={"message": f"Queue for room {room_id} cleared"}, status_code=200)
     except redis.RedisError as e:
         raise HTTPException(status_code=500, detail=f"Redis error: {e}")
 
@@ -190,14 +190,14 @@ async def clear_queue_endpoint(
 
 
 @router.post("/{room_id}/update_queue_idx")
-async def store_current_idx(room_id: str, data: dict[str, int], redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db()))):
+async def store_current_idx(room_id: str, data: dict[str, int], redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db()))):
     current_idx = data["index"]
     # Use a Redis key that includes the room ID
     try:
         key = f"room:{room_id}:queue:current_idx"
-        redis_interface.redis.set(key, current_idx)
-        return JSONResponse(content={"message": f"Current index for room {room_id} 's queue is set to {current_idx}"}, status_code=200)
+        await redis_interface.redis.set(key, current_idx)
+        return CamelJSONResponse(content={"message": f"Current index for room {room_id} 's queue is set to {current_idx}"}, status_code=200)
     except redis.RedisError as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to store current index: {e}")
@@ -209,8 +209,8 @@ async def store_current_idx(room_id: str, data: dict[str, int], redis_interface:
 async def add_to_next_endpoint(
     room_id: str,
     track: Track,
-    redis_interface: RedisQueueInterface = Depends(
-        lambda: RedisQueueInterface(get_db())),
+    redis_interface: AsyncRedisQueueInterface = Depends(
+        lambda: AsyncRedisQueueInterface(get_async_db())),
 ):
     """
     Adds a track to be played next after the current playing track.
@@ -221,10 +221,10 @@ async def add_to_next_endpoint(
     """
     try:
 
-        is_track_ready = is_ready(track)
+        is_track_ready = await run_in_threadpool(is_ready, track)
         track.status = "ready" if is_track_ready else "submitted"
 
-        idx = redis_interface.add_track_to_next(room_id, track)
+        idx = await redis_interface.add_track_to_next(room_id, track)
         await ws_manager.broadcast(
             {"type": "queue", "data": {
                 "action": "inserted",
@@ -233,13 +233,12 @@ async def add_to_next_endpoint(
             }}
         )
         if is_track_ready:
-            return JSONResponse(content={"is_ready": True, "task": None}, status_code=200)
-
-        loop = asyncio.get_event_loop()
+            return CamelJSONResponse(content={"is_ready": True, "task": None}, status_code=200)
 
-        def process_message_callback(message_data: dict):
+        async def process_message_callback(message_data: dict):
             """
-            Callback to handle messages from the Redis pub/sub related to track processing.
+            Callback to store the processing status of the track in the room's queue. The
+            clients get the messages themselves from the WebSocket manager.
             """
             # "type": "notify",
             # "data": {
@@ -253,21 +252,24 @@ async def add_to_next_endpoint(
             if message_type == "notify":
                 # Check if the message is for the current track
                 if message_data["data"]["track"]["id"] == track.id:
-                    track.status = message_data["data"]["status"]
+                    status = message_data["data"]["status"]
                     if "total" in message_data["data"]:
-                        track.progress = message_data["data"]["value"] / \
+                        progress = message_data["data"]["value"] / \
                             message_data["data"]["total"]
+                    elif status != track.status:
+                        progress = 0
                     else:
-                        track.progress = 0
-                    redis_interface.update_track_status(room_id, track)
-            asyncio.run_coroutine_threadsafe(ws_manager.broadcast(
-                message_data), loop)
+                        # e.g. the "playable" notice, nothing to store.
+                        progress = track.progress
+                    if status != track.status or progress != track.progress:
+                        track.status = status
+                        track.progress = progress
+                        await redis_interface.update_track_status(room_id, track)
 
-        redis_interface.subscribe_to_channel(
-            track.id, process_message_callback)
+        await get_pubsub().watch_progress(track.id, process_message_callback)
 
-        task = send_process_request(track)
-        return JSONResponse(content={"is_ready": False, "task": task.id}, status_code=200)
+        task = await run_in_threadpool(send_process_request, track)
+        return CamelJSONResponse(content={"is_ready": False, "task": task.id}, status_code=200)
 
     except redis.RedisError as e:
         raise HTTPException(status_code=500, detail=f"Redis error: {e}")
@@ -2,10 +2,9 @@ import json
 import redis
 from fastapi import APIRouter, Depends, HTTPException
 from models.user import User
-from interfaces.queue import RedisQueueInterface
-from interfaces.jam import RedisJamInterface
+from interfaces.jam import AsyncRedisJamInterface
 from managers.websocket import WebSocketManager
-from managers.db import get_db
+from managers.db import get_async_db
 from models.jam import Room
 
 router = APIRouter()
@@ -17,8 +16,8 @@ ws_manager = WebSocketManager()
 @router.post("/create")
 async def create_room(
     room: Room,
-    redis_interface: RedisJamInterface = Depends(
-        lambda: RedisJamInterface(get_db())),
+    redis_interface: AsyncRedisJamInterface = Depends(
+        lambda: AsyncRedisJamInterface(get_async_db())),
 ):
     """
     Create a Room / Jam for each user.
@@ -27,7 +26,7 @@ async def create_room(
     try:
         jam_state = room.model_dump()
         jam_state["is_on"] = True
-        redis_interface.create_or_update_jam_state(room.id, room.model_dump())
+        await redis_interface.create_or_update_jam_state(room.id, room.model_dump())
         return {"message": f"Room {room.id} created successfully."}
         # room_exists = redis_interface.jam_exists(
         #     room.id)  # Use the new room_exists method
@@ -44,18 +43,18 @@ async def create_room(
             status_code=500, detail=f"Failed to create room: {e}")
 
 
-# Deprecated: WE DON'T NEED TO STORE PARTICIPANTS IN REDIS
+# Deprecated: participants are recorded in Redis when their socket joins the room
 @router.post("/{room_id}/join")
-async def join_room(room_id: str, user: User, redis_interface: RedisJamInterface = Depends(lambda: RedisJamInterface(get_db()))):
+async def join_room(room_id: str, user: User, redis_interface: AsyncRedisJamInterface = Depends(lambda: AsyncRedisJamInterface(get_async_db()))):
     """
     Add participants into a room, they should share the same queue under the same room_id
     """
     try:
         # Check if the room exists
-        if not redis_interface.jam_exists(room_id):
+        if not await redis_interface.jam_exists(room_id):
             if user.id == room_id:
                 # Create a new room if it doesn't exist
-                redis_interface.create_or_update_jam_state(
+                await redis_interface.create_or_update_jam_state(
                     room_id, {"id": room_id, "is_on": True})
             else:
                 raise HTTPException(
@@ -82,15 +81,15 @@ async def join_room(room_id: str, user: User, redis_interface: RedisJamInterface
 async def leave_room(
     room_id: str,
     user: User,
-    redis_interface: RedisJamInterface = Depends(
-        lambda: RedisJamInterface(get_db())),
+    redis_interface: AsyncRedisJamInterface = Depends(
+        lambda: AsyncRedisJamInterface(get_async_db())),
 ):
     """
     Remove participants from a room
     """
     try:
         # Check if the room exists
-        if not redis_interface.jam_exists(room_id):
+        if not await redis_interface.jam_exists(room_id):
             raise HTTPException(
                 status_code=404, detail=f"Room {room_id} not found")
 
@@ -112,27 +111,21 @@ async def leave_room(
 @router.get("/{room_id}")
 async def get_room(
     room_id: str,
-    redis_interface: RedisJamInterface = Depends(
-        lambda: RedisJamInterface(get_db())),
+    redis_interface: AsyncRedisJamInterface = Depends(
+        lambda: AsyncRedisJamInterface(get_async_db())),
 ):
     """
     Get a room by ID
     """
     try:
-        jam_state = redis_interface.get_jam_state(room_id)
-        participants = ws_manager.rooms.get(room_id, [])
+        jam_state = await redis_interface.get_jam_state(room_id)
         if not jam_state:
             return None
 
-        seen = set()
-        deduped = []
-        for p, _ in participants:
-            if p.id not in seen:
-                deduped.append(p.model_dump())
-                seen.add(p.id)
+        participants = await redis_interface.get_participants(room_id)
         return {
             **jam_state.model_dump(),
-            "participants": deduped,
+            "participants": [p.model_dump() for p in participants],
         }
     except redis.RedisError as e:
         raise HTTPException(
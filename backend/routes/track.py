@@ -1,25 +1,110 @@
+import hashlib
 import json
-from fastapi import APIRouter
+import os
+from typing import Callable, Optional
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import FileResponse
-from utils import get_instrumental_path, get_midi_path, get_vocal_path
+from utils import (AUDIO_VARIANTS, get_hls_path, get_instrumental_path, get_midi_path,
+                   get_partial_instrumental_path, get_partial_vocal_path, get_vocal_path)
 
 router = APIRouter()
 
+# Separated stems never change once written, let clients and proxies keep them.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# The mp3 served in place of a rendition that is not encoded yet, which the same URL
+# serves once it is.
+FALLBACK_CACHE_CONTROL = "public, max-age=60"
 
-@router.get("/instrumental/{filename}")
-def get_instrumental(filename: str):
-    file_path = get_instrumental_path(filename)
+
+def file_etag(file_path: str) -> str:
+    """Same ETag as `FileResponse` computes, from the modification time and size."""
+    stat = os.stat(file_path)
+    etag_base = f"{stat.st_mtime}-{stat.st_size}"
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def cached_file_response(request: Request, file_path: str, media_type: str,
+                         filename: str, headers: dict[str, str],
+                         cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Response:
+    """
+    Serves a file with a Cache-Control, long-lived by default, and an ETag, answering
+    304 Not Modified when the client already has it. `FileResponse` takes care of
+    Range requests (206 Partial Content) for seeking and resumed downloads.
+    """
+    etag = file_etag(file_path)
+    headers = {**headers, "ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, media_type=media_type, filename=filename, headers=headers)
+
+
+def negotiate_variant(request: Request, format: Optional[str]) -> str:
+    """
+    Picks the stem rendition from the `format` query parameter, then from the Accept
+    header. Defaults to mp3, which every client can play.
+    """
+    if format in AUDIO_VARIANTS:
+        return format
+    accept = request.headers.get("accept", "")
+    if "audio/mp4" in accept or "audio/aac" in accept:
+        return "aac"
+    return "mp3"
+
+
+def stem_response(request: Request, filename: str, variant: str,
+                  get_path: Callable[..., str | None],
+                  get_partial_path: Callable[[str], str | None]):
+    # Compact renditions are encoded after the separation, fall back to the mp3. The
+    # fallback is only cached briefly, so that the rendition replaces it once encoded.
+    for candidate in dict.fromkeys([variant, "mp3"]):
+        file_path = get_path(filename, candidate)
+        if file_path:
+            cache_control = (IMMUTABLE_CACHE_CONTROL if candidate == variant
+                             else FALLBACK_CACHE_CONTROL)
+            return cached_file_response(request, file_path, AUDIO_VARIANTS[candidate][1],
+                                        filename, {"Vary": "Accept"}, cache_control)
+    # The separation is still running, serve what has been encoded so far. The file
+    # is still growing, so it must not be cached.
+    file_path = get_partial_path(filename)
     if file_path:
-        return FileResponse(file_path, media_type="audio/mpeg", filename=filename)
+        return FileResponse(file_path, media_type="audio/mpeg", filename=filename,
+                            headers={"Cache-Control": "no-store", "Vary": "Accept"})
     return {"error": "File not found"}
 
 
+@router.get("/instrumental/{filename}")
+def get_instrumental(filename: str, request: Request, format: Optional[str] = None):
+    return stem_response(request, filename, negotiate_variant(request, format),
+                         get_instrumental_path, get_partial_instrumental_path)
+
+
 @router.get("/vocal/{filename}")
-def get_vocal(filename: str):
-    file_path = get_vocal_path(filename)
-    if file_path:
-        return FileResponse(file_path, media_type="audio/mpeg", filename=filename)
-    return {"error": "File not found"}
+def get_vocal(filename: str, request: Request, format: Optional[str] = None):
+    return stem_response(request, filename, negotiate_variant(request, format),
+                         get_vocal_path, get_partial_vocal_path)
+
+
+@router.get("/hls/{stem}/{filename}/{name}")
+def get_hls(stem: str, filename: str, name: str, request: Request):
+    """
+    HLS rendition of a stem: `index.m3u8` lists fixed-duration segments, served from
+    the same directory. Segments of the vocal and the instrumental are aligned, so a
+    player can start after the first one and keep both stems in sync.
+    """
+    file_path = get_hls_path(stem, filename, name)
+    if not file_path:
+        return {"error": "File not found"}
+    if name.endswith(".m3u8"):
+        media_type = "application/vnd.apple.mpegurl"
+    else:
+        media_type = "video/mp2t"
+    return cached_file_response(request, file_path, media_type, name, {})
 
 
 @router.get("/midi/{filename}")
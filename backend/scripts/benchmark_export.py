@@ -0,0 +1,65 @@
+import argparse
+import statistics
+import time
+
+import torch as th
+
+from managers.model import get_device, get_model_manager
+
+
+def sync(device: str):
+    if device == "cuda":
+        th.cuda.synchronize()
+
+
+def time_forward(forward, mix: th.Tensor, device: str, iterations: int) -> list[float]:
+    times = []
+    with th.no_grad():
+        for _ in range(iterations):
+            start = time.perf_counter()
+            forward(mix)
+            sync(device)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the eager and the compiled separation model. Run it twice: "
+                    "the first run builds the artifact, the second one loads it from disk.")
+    parser.add_argument("--model", default="htdemucs")
+    parser.add_argument("--device", default=get_device())
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    manager = get_model_manager()
+    start = time.perf_counter()
+    model = manager.get_model(args.model, args.device)
+    print(f"Load model: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    exported = manager.export(args.model, args.device, batch=args.batch)
+    if exported is None:
+        print(f"{args.model} on {args.device} cannot be compiled")
+        return
+    print(f"Cold start ({exported.kind}): {time.perf_counter() - start:.2f}s")
+
+    mix = th.randn(exported.shape, device=args.device)
+    stem = model.sources.index("vocals")
+    # First eager call pays for allocator warm up, leave it out of the numbers.
+    time_forward(lambda x: model(x, stem=stem), mix, args.device, 1)
+    eager = time_forward(lambda x: model(x, stem=stem), mix, args.device, args.iterations)
+    compiled = time_forward(exported, mix, args.device, args.iterations)
+
+    with th.no_grad():
+        error = (model(mix, stem=stem) - exported(mix)).abs().max().item()
+    for label, times in (("eager", eager), ("compiled", compiled)):
+        print(f"{label:>8}: {statistics.median(times) * 1000:.1f}ms median, "
+              f"{min(times) * 1000:.1f}ms min per chunk of {tuple(mix.shape)}")
+    print(f"Speedup: {statistics.median(eager) / statistics.median(compiled):.2f}x, "
+          f"max abs difference {error:.2e}")
+
+
+if __name__ == "__main__":
+    main()
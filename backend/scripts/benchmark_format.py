@@ -0,0 +1,89 @@
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from typing import cast
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from middlewares.format import CamelJSONResponse, convert_keys
+
+
+class LegacyFormatMiddleware(BaseHTTPMiddleware):
+    """The previous FormatReponseMiddleware: buffers, decodes and re-encodes every
+    JSON body."""
+
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        if response.headers.get('content-type') != 'application/json':
+            return response
+        stream_response = cast(StreamingResponse, response)
+        chunks = []
+        async for chunk in stream_response.body_iterator:
+            chunks.append(chunk)
+        data = json.loads(b''.join(chunks))
+        return JSONResponse(content=convert_keys(data), status_code=response.status_code)
+
+
+def make_payload(tracks: int) -> dict:
+    return {"collection": {"display_name": "Benchmark", "track_count": tracks},
+            "tracks": [{"id": str(i), "name": f"Track {i}", "duration_ms": 200000,
+                        "album": {"album_type": "album", "release_date": "2024-01-01",
+                                  "images": [{"url": "https://example.com", "height": 640}]},
+                        "artists": [{"id": "artist", "name": "Artist", "external_urls": {}}]}
+                       for i in range(tracks)]}
+
+
+def legacy_app(payload: dict) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(LegacyFormatMiddleware)
+
+    @app.get("/tracks")
+    async def tracks():
+        return JSONResponse(content=payload)
+    return app
+
+
+def camel_app(payload: dict) -> FastAPI:
+    app = FastAPI(default_response_class=CamelJSONResponse)
+
+    @app.get("/tracks")
+    async def tracks():
+        return CamelJSONResponse(content=payload)
+    return app
+
+
+def measure(app: FastAPI, requests: int) -> tuple[list[float], int]:
+    with TestClient(app) as client:
+        expected = client.get("/tracks").json()
+        times = []
+        tracemalloc.start()
+        for _ in range(requests):
+            start = time.perf_counter()
+            assert client.get("/tracks").json() == expected
+            times.append(time.perf_counter() - start)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return times, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Camel-case middleware vs response class.")
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = make_payload(args.tracks)
+    for label, app in (("middleware", legacy_app(payload)), ("response", camel_app(payload))):
+        times, peak = measure(app, args.requests)
+        print(f"{label:>10}: {statistics.median(times) * 1000:.2f}ms median, "
+              f"{statistics.quantiles(times, n=100)[98] * 1000:.2f}ms p99, "
+              f"{peak / 2**20:.1f} MiB peak traced allocations")
+
+
+if __name__ == "__main__":
+    main()
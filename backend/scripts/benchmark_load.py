@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+import websockets
+
+
+def percentiles(times: list[float]) -> str:
+    if len(times) < 2:
+        return "not enough samples"
+    quantiles = statistics.quantiles(times, n=100)
+    return ", ".join(f"p{p} {quantiles[p - 1] * 1000:.1f}ms" for p in (50, 95, 99))
+
+
+async def listen(url: str, room_id: str, index: int, total: int, joined: asyncio.Event,
+                 clients: list, latencies: list[float]):
+    """A phone in the room: joins it, then records the delay of the jam messages."""
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"type": "join", "roomId": room_id, "data": {
+            "id": f"load-{index}", "name": f"Load {index}", "avatar": ""}}))
+        clients.append(ws)
+        if len(clients) == total:
+            joined.set()
+        async for raw in ws:
+            message = json.loads(raw)
+            if message.get("type") == "jam" and "sentAt" in message:
+                latencies.append(time.time() - message["sentAt"])
+
+
+async def drive_jam(url: str, room_id: str, rate: float, duration: float):
+    """The host: sends playback updates, relayed to every other socket of the room."""
+    async with websockets.connect(url) as ws:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            await ws.send(json.dumps({"type": "jam", "roomId": room_id, "sentAt": time.time(),
+                                      "data": {"currentTime": time.time(), "playing": True}}))
+            await asyncio.sleep(1 / rate)
+
+
+async def drive_http(base_url: str, room_id: str, concurrency: int, duration: float,
+                     latencies: list[float], enqueue: bool = False):
+    """Queue and room reads, as done by the clients when they (re)load a room, and
+    track additions if `enqueue` is set."""
+    requests = [("GET", f"/queue/{room_id}/tracks", None), ("GET", f"/room/{room_id}", None)]
+    if enqueue:
+        # The track does not exist, the worker fails it after the request is timed.
+        track = {"id": "load-test-track", "name": "Load test", "artists": [
+            {"id": "load-test", "uri": "", "name": "Load test"}]}
+        requests.append(("POST", f"/queue/{room_id}/add", track))
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        async def worker(offset: int):
+            end = time.monotonic() + duration
+            i = offset
+            while time.monotonic() < end:
+                method, path, body = requests[i % len(requests)]
+                start = time.perf_counter()
+                response = await client.request(method, path, json=body)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                i += 1
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Load test a running API: many WebSocket clients in a room, while "
+                    "HTTP clients read the queue and the room, and with --enqueue add "
+                    "tracks to the queue. Run it against the server before and after a "
+                    "change and compare the percentiles.")
+    parser.add_argument("--url", default="http://localhost:8000",
+                        help="Base URL of the API, without the /api root path of the proxy")
+    parser.add_argument("--room", default="load-test")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--jam-rate", type=float, default=20, help="Jam messages per second")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Also add tracks to the queue, which submits them to the workers")
+    args = parser.parse_args()
+
+    ws_url = args.url.replace("http", "ws", 1) + "/ws"
+    joined = asyncio.Event()
+    clients: list = []
+    ws_latencies: list[float] = []
+    http_latencies: list[float] = []
+
+    listeners = [asyncio.create_task(listen(ws_url, args.room, i, args.clients, joined,
+                                         clients, ws_latencies))
+                 for i in range(args.clients)]
+    await asyncio.wait_for(joined.wait(), timeout=60)
+    print(f"{len(clients)} WebSocket clients joined {args.room}")
+
+    await asyncio.gather(drive_jam(ws_url, args.room, args.jam_rate, args.duration),
+                         drive_http(args.url, args.room, args.concurrency, args.duration,
+                                    http_latencies, args.enqueue))
+    # Let the last messages arrive.
+    await asyncio.sleep(1)
+    for listener in listeners:
+        listener.cancel()
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+    print(f"HTTP: {len(http_latencies)} requests, {percentiles(http_latencies)}")
+    print(f"WebSocket fan-out: {len(ws_latencies)} messages, {percentiles(ws_latencies)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+import argparse
+import statistics
+import time
+
+import torch
+from openunmix.filtering import wiener as openunmix_wiener
+
+from services.demucs.wiener import wiener
+
+
+def loop_wiener(mag_out: torch.Tensor, mix_stft: torch.Tensor, niters: int,
+                wiener_win_len: int = 300) -> torch.Tensor:
+    """The previous `HTDemucs._wiener`: one openunmix call per batch item and window."""
+    B, S, C, Fq, T = mag_out.shape
+    mag_out = mag_out.permute(0, 4, 3, 2, 1)
+    mix_stft = torch.view_as_real(mix_stft.permute(0, 3, 2, 1))
+    outs = []
+    for sample in range(B):
+        out = []
+        for pos in range(0, T, wiener_win_len):
+            frame = slice(pos, pos + wiener_win_len)
+            z_out = openunmix_wiener(mag_out[sample, frame], mix_stft[sample, frame], niters)
+            out.append(z_out.transpose(-1, -2))
+        outs.append(torch.cat(out, dim=0))
+    out = torch.view_as_complex(torch.stack(outs, 0))
+    return out.permute(0, 4, 3, 2, 1).contiguous()
+
+
+def vectorised_wiener(mag_out: torch.Tensor, mix_stft: torch.Tensor, niters: int,
+                      wiener_win_len: int = 300) -> torch.Tensor:
+    """Same padding and reshaping as `HTDemucs._wiener`."""
+    B, S, C, Fq, T = mag_out.shape
+    windows = (T + wiener_win_len - 1) // wiener_win_len
+    pad = windows * wiener_win_len - T
+    mag_out = torch.nn.functional.pad(mag_out, (0, pad)).permute(0, 4, 3, 2, 1)
+    mix_stft = torch.view_as_complex(torch.nn.functional.pad(
+        torch.view_as_real(mix_stft), (0, 0, 0, pad))).permute(0, 3, 2, 1)
+    out = wiener(mag_out.reshape(B * windows, wiener_win_len, Fq, C, S),
+                 mix_stft.reshape(B * windows, wiener_win_len, Fq, C), niters)
+    out = out.reshape(B, windows * wiener_win_len, Fq, C, S)[:, :T]
+    return out.permute(0, 4, 3, 2, 1).contiguous()
+
+
+def measure(fn, *args, repeats: int) -> float:
+    times = []
+    with torch.no_grad():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn(*args)
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-window loop vs vectorised Wiener filtering.")
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=1024,
+                        help="STFT frames per batch item, 336 for one HTDemucs segment")
+    parser.add_argument("--bins", type=int, default=2048)
+    parser.add_argument("--sources", type=int, default=4)
+    parser.add_argument("--niters", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    shape = (args.batch, args.sources, 2, args.bins, args.frames)
+    mag_out = torch.rand(shape)
+    mix_stft = torch.randn(args.batch, 2, args.bins, args.frames, dtype=torch.complex64)
+
+    for niters in args.niters:
+        expected = loop_wiener(mag_out, mix_stft, niters)
+        error = (expected - vectorised_wiener(mag_out, mix_stft, niters)).abs().max().item()
+        loop = measure(loop_wiener, mag_out, mix_stft, niters, repeats=args.repeats)
+        vectorised = measure(vectorised_wiener, mag_out, mix_stft, niters,
+                             repeats=args.repeats)
+        print(f"niters={niters}: loop {loop * 1000:.0f}ms, vectorised {vectorised * 1000:.0f}ms "
+              f"({loop / vectorised:.2f}x), max abs difference {error:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import time
+from pathlib import Path
+
+import torch as th
+
+from managers.model import get_model_manager
+from services.demucs.apply import apply_model
+from services.demucs.separate import load_track
+from utils import RAW_AUDIO_DIR
+
+
+def separate(model, wav: th.Tensor) -> tuple[th.Tensor, float]:
+    start = time.perf_counter()
+    with th.no_grad():
+        sources = apply_model(model, wav[None], device="cpu", shifts=0, split=True,
+                              overlap=0.25, num_workers=1)
+    return sources, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the int8 quantized separation model against the float one.")
+    parser.add_argument("track_id", help="ID of a track in the raw audio directory")
+    parser.add_argument("--model", default="htdemucs")
+    parser.add_argument("--offset", type=float, default=30., help="Clip start (seconds)")
+    parser.add_argument("--duration", type=float, default=30., help="Clip length (seconds)")
+    args = parser.parse_args()
+
+    # evaluate pulls in musdb and museval, only needed here.
+    from services.demucs.evaluate import new_sdr
+
+    manager = get_model_manager()
+    reference = manager.get_model(args.model, "cpu")
+    quantized = manager.get_model(args.model, "cpu", precision="int8")
+
+    samplerate = reference.samplerate
+    wav = load_track(Path(RAW_AUDIO_DIR, f"{args.track_id}.mp3"),
+                     reference.audio_channels, samplerate)
+    start = int(args.offset * samplerate)
+    wav = wav[:, start:start + int(args.duration * samplerate)]
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+
+    expected, float_time = separate(reference, wav)
+    estimate, int8_time = separate(quantized, wav)
+
+    # new_sdr takes [B, S, T, C]
+    scores = new_sdr(expected.transpose(2, 3), estimate.transpose(2, 3))[0]
+    for source, score in zip(reference.sources, scores.tolist()):
+        print(f"{source:>8}: {score:.2f} dB SDR against float32")
+    print(f"float32: {float_time:.2f}s, int8: {int8_time:.2f}s "
+          f"({float_time / int8_time:.2f}x) for {wav.shape[-1] / samplerate:.0f}s of audio")
+
+
+if __name__ == "__main__":
+    main()
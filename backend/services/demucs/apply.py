@@ -19,10 +19,16 @@ import tqdm
 from .demucs import Demucs
 from .hdemucs import HDemucs
 from .htdemucs import HTDemucs
-from .utils import center_trim, DummyPoolExecutor
+from .utils import center_trim, DummyPoolExecutor, two_stems
 
 Model = tp.Union[Demucs, HDemucs, HTDemucs]
 
+# Estimated activation memory (in bytes) a forward pass needs per input sample and
+# batch item of HTDemucs in float32, about 700 MB for a 7.8s segment. An estimate, not
+# a measurement: lower it if batched inference runs out of memory. Used to turn a
+# memory budget into a number of segments to run in a single forward.
+BATCH_BYTES_PER_SAMPLE = 2048
+
 
 class BagOfModels(nn.Module):
     def __init__(self, models: tp.List[Model],
@@ -131,6 +137,78 @@ def tensor_chunk(tensor_or_chunk):
         return TensorChunk(tensor_or_chunk)
 
 
+def _valid_length(model: Model, length: int, segment: tp.Optional[float]) -> int:
+    if isinstance(model, HTDemucs) and segment is not None:
+        return int(segment * model.samplerate)
+    elif hasattr(model, 'valid_length'):
+        return model.valid_length(length)  # type: ignore
+    return length
+
+
+def batch_size_for_memory(model: Model, segment_length: int, batch: int,
+                          max_batch_memory: int) -> int:
+    """Number of segments that can go through the model in one forward pass
+    without exceeding `max_batch_memory` bytes of activations."""
+    per_segment = BATCH_BYTES_PER_SAMPLE * segment_length * batch
+    return max(1, int(max_batch_memory // per_segment))
+
+
+def _forward(model: Model, mix: th.Tensor, stem: tp.Optional[str]) -> th.Tensor:
+    """Run a single forward pass, reducing the output to (stem, sum of the others)
+    if `stem` is given. HTDemucs does the reduction before its iSTFT.
+    Uses the compiled forward attached by `export.export_model` when the shape matches."""
+    index = None if stem is None else model.sources.index(stem)
+    with th.no_grad():
+        exported = getattr(model, 'exported', None)
+        if exported is not None and exported.matches(mix, index):
+            return exported(mix)
+        if index is None:
+            return model(mix)
+        if isinstance(model, HTDemucs):
+            return model(mix, stem=index)
+        return two_stems(model(mix), index)
+
+
+def _apply_batch(model: Model, chunks: tp.List[TensorChunk], device,
+                 segment: tp.Optional[float], stem: tp.Optional[str] = None
+                 ) -> tp.List[th.Tensor]:
+    """Run several chunks through the model with a single forward pass.
+    Chunks are stacked along the batch dimension, which is safe as every model
+    normalizes each batch item independently."""
+    lengths = [chunk.length for chunk in chunks]
+    padded = [chunk.padded(_valid_length(model, length, segment))
+              for chunk, length in zip(chunks, lengths)]
+    if any(p.shape != padded[0].shape for p in padded):
+        # Only happens for models whose valid length depends on the input length
+        # (e.g. the shorter last chunk with Demucs), fall back to one pass per chunk.
+        outs = [_forward(model, p.to(device), stem) for p in padded]
+    else:
+        out = _forward(model, th.cat(padded).to(device), stem)
+        outs = list(out.chunk(len(chunks)))
+    return [center_trim(out, length) for out, length in zip(outs, lengths)]
+
+
+def _iter_batched(model: Model, mix, offsets: tp.Sequence[int], segment_length: int,
+                  batch_size: int, device, segment: tp.Optional[float],
+                  stem: tp.Optional[str] = None) -> tp.Iterator[tp.Tuple[th.Tensor, int]]:
+    for start in range(0, len(offsets), batch_size):
+        group = offsets[start:start + batch_size]
+        chunks = [TensorChunk(mix, offset, segment_length) for offset in group]
+        for chunk_out, offset in zip(_apply_batch(model, chunks, device, segment, stem), group):
+            yield chunk_out, offset
+
+
+def _shift_on_chunk(on_chunk: tp.Callable[[th.Tensor, int], None], delta: int
+                    ) -> tp.Callable[[th.Tensor, int], None]:
+    """Translate streamed chunks of a shifted input back to the unshifted timeline,
+    dropping the leading `delta` samples that `apply_model` trims off."""
+    def _on_chunk(chunk: th.Tensor, start: int):
+        skip = max(delta - start, 0)
+        if skip < chunk.shape[-1]:
+            on_chunk(chunk[..., skip:], start + skip - delta)
+    return _on_chunk
+
+
 def apply_model(model: tp.Union[BagOfModels, Model],
                 mix: tp.Union[th.Tensor, TensorChunk],
                 shifts: int = 1, split: bool = True,
@@ -139,7 +217,10 @@ def apply_model(model: tp.Union[BagOfModels, Model],
                 num_workers: int = 0, segment: tp.Optional[float] = None,
                 on_progress: tp.Optional[tp.Callable[[
                     float, float], None]] = None,
-                pool=None) -> th.Tensor:
+                pool=None, batch_size: int = 1,
+                max_batch_memory: tp.Optional[int] = None,
+                on_chunk: tp.Optional[tp.Callable[[th.Tensor, int], None]] = None,
+                stem: tp.Optional[str] = None) -> th.Tensor:
     """
     Apply model to a given mixture.
 
@@ -159,6 +240,19 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         num_workers (int): if non zero, device is 'cpu', how many threads to
             use in parallel.
         segment (float or None): override the model segment parameter.
+        batch_size (int): if > 1, that many segments are stacked and processed with a
+            single forward pass instead of one pass per segment on the pool (requires
+            split=True).
+        max_batch_memory (int or None): if provided, memory budget in bytes used to pick
+            `batch_size` automatically.
+        on_chunk (callable or None): called with `(estimate, start)` every time a stretch of
+            the output is final, i.e. no later segment overlaps it. Stretches are contiguous
+            and come in order, so they can be encoded as they arrive. Only a single model
+            with split=True and at most one shift streams; otherwise `on_chunk` is called
+            once with the whole estimate.
+        stem (str or None): if provided, only 2 sources are returned: `stem` and the sum of
+            all the other sources. The reduction happens right after each forward pass,
+            so the full set of sources is never accumulated for the whole track.
     """
     if device is None:
         device = mix.device
@@ -178,6 +272,9 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         'device': device,
         'pool': pool,
         'segment': segment,
+        'batch_size': batch_size,
+        'max_batch_memory': max_batch_memory,
+        'stem': stem,
     }
     out: tp.Union[float, th.Tensor]
     if isinstance(model, BagOfModels):
@@ -190,7 +287,9 @@ def apply_model(model: tp.Union[BagOfModels, Model],
             original_model_device = next(iter(sub_model.parameters())).device
             sub_model.to(device)
 
-            out = apply_model(sub_model, mix, **kwargs, on_progress=on_progress)
+            # Source weights differ per model, reduce to two stems after weighting.
+            out = apply_model(sub_model, mix, **{**kwargs, 'stem': None},
+                              on_progress=on_progress)
             sub_model.to(original_model_device)
             for k, inst_weight in enumerate(model_weights):
                 out[:, k, :, :] *= inst_weight
@@ -201,6 +300,10 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         assert isinstance(estimates, th.Tensor)
         for k in range(estimates.shape[1]):
             estimates[:, k, :, :] /= totals[k]
+        if stem is not None:
+            estimates = two_stems(estimates, model.sources.index(stem))
+        if on_chunk is not None:
+            on_chunk(estimates, 0)
         return estimates
 
     model.to(device)
@@ -218,15 +321,21 @@ def apply_model(model: tp.Union[BagOfModels, Model],
             offset = random.randint(0, max_shift)
             shifted = TensorChunk(padded_mix, offset,
                                   length + max_shift - offset)
+            shifted_on_chunk = None
+            if on_chunk is not None and shifts == 1:
+                shifted_on_chunk = _shift_on_chunk(on_chunk, max_shift - offset)
             shifted_out = apply_model(
-                model, shifted, **kwargs, on_progress=on_progress)
+                model, shifted, **kwargs, on_progress=on_progress,
+                on_chunk=shifted_on_chunk)
             out += shifted_out[..., max_shift - offset:]
         out /= shifts
         assert isinstance(out, th.Tensor)
+        if on_chunk is not None and shifts > 1:
+            on_chunk(out, 0)
         return out
     elif split:
         kwargs['split'] = False
-        out = th.zeros(batch, len(model.sources),
+        out = th.zeros(batch, 2 if stem is not None else len(model.sources),
                        channels, length, device=mix.device)
         sum_weight = th.zeros(length, device=mix.device)
         if segment is None:
@@ -245,46 +354,58 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         # If the overlap < 50%, this will translate to linear transition when
         # transition_power is 1.
         weight = (weight / weight.max())**transition_power
-        futures = []
-        for offset in offsets:
-            chunk = TensorChunk(mix, offset, segment_length)
-            future = pool.submit(apply_model, model, chunk,
-                                 **kwargs, on_progress=on_progress)
-            futures.append((future, offset))
-            offset += segment_length
+        if max_batch_memory is not None:
+            batch_size = batch_size_for_memory(
+                model, segment_length, batch, max_batch_memory)
+        results: tp.Iterable[tp.Tuple[th.Tensor, int]]
+        if batch_size > 1:
+            results = _iter_batched(model, mix, offsets, segment_length,
+                                    batch_size, device, segment, stem)
+        else:
+            futures = []
+            for offset in offsets:
+                chunk = TensorChunk(mix, offset, segment_length)
+                future = pool.submit(apply_model, model, chunk,
+                                     **kwargs, on_progress=on_progress)
+                futures.append((future, offset))
+            results = ((future.result(), offset) for future, offset in futures)
         if progress:
-            futures = tqdm.tqdm(futures, unit_scale=scale,
+            results = tqdm.tqdm(results, total=len(offsets), unit_scale=scale,
                                 ncols=120, unit='seconds')
-        for future, offset in futures:
+        finalized = 0
+        for chunk_out, offset in results:
             if on_progress is not None:
                 # We report the progress as the offset in seconds.
                 on_progress(offset / model.samplerate,
-                           length / model.samplerate)
-            chunk_out = future.result()
+                            length / model.samplerate)
             chunk_length = chunk_out.shape[-1]
             out[..., offset:offset + segment_length] += (
                 weight[:chunk_length] * chunk_out).to(mix.device)
             sum_weight[offset:offset +
                        segment_length] += weight[:chunk_length].to(mix.device)
+            if on_chunk is not None:
+                # Segments come in order, everything before the next offset is final.
+                end = min(offset + stride, length)
+                if end > finalized:
+                    on_chunk(out[..., finalized:end] / sum_weight[finalized:end], finalized)
+                    finalized = end
 
         if on_progress is not None:
             on_progress(length / model.samplerate, length / model.samplerate)
         assert sum_weight.min() > 0
         out /= sum_weight
         assert isinstance(out, th.Tensor)
+        if on_chunk is not None and finalized < length:
+            on_chunk(out[..., finalized:], finalized)
         return out
     else:
-        valid_length: int
-        if isinstance(model, HTDemucs) and segment is not None:
-            valid_length = int(segment * model.samplerate)
-        elif hasattr(model, 'valid_length'):
-            valid_length = model.valid_length(length)  # type: ignore
-        else:
-            valid_length = length
+        valid_length = _valid_length(model, length, segment)
         mix = tensor_chunk(mix)
         assert isinstance(mix, TensorChunk)
         padded_mix = mix.padded(valid_length).to(device)
-        with th.no_grad():
-            out = model(padded_mix)
+        out = _forward(model, padded_mix, stem)
         assert isinstance(out, th.Tensor)
-        return center_trim(out, length)
+        out = center_trim(out, length)
+        if on_chunk is not None:
+            on_chunk(out, 0)
+        return out
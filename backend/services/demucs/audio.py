@@ -3,6 +3,8 @@
 #
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
 import subprocess as sp
 from pathlib import Path
@@ -25,6 +27,36 @@ def _read_info(path):
     return json.loads(stdout_data.decode('utf-8'))
 
 
+def _readinto(stream: tp.BinaryIO, buffer: np.ndarray, offset: int = 0) -> int:
+    """Fill `buffer` from `stream`, starting at byte `offset`, until it is full or the
+    stream ends. Returns the number of bytes in the buffer."""
+    view = memoryview(buffer).cast('B')
+    while offset < len(view):
+        read = stream.readinto(view[offset:])  # type: ignore
+        if not read:
+            break
+        offset += read
+    return offset
+
+
+def _read_pipe(command: tp.List[str], size_hint: int) -> np.ndarray:
+    """Run ffmpeg writing f32le to its stdout and decode it straight into a float32
+    buffer of `size_hint` samples, grown if ffmpeg outputs more."""
+    buffer = np.empty(max(size_hint, 1), dtype=np.float32)
+    with sp.Popen(command, stdout=sp.PIPE) as proc:
+        assert proc.stdout is not None
+        size = _readinto(proc.stdout, buffer)
+        while size == buffer.nbytes:
+            # The duration from ffprobe was an underestimate.
+            grown = np.empty(buffer.size + buffer.size // 2 + 1, dtype=np.float32)
+            grown[:buffer.size] = buffer
+            buffer = grown
+            size = _readinto(proc.stdout, buffer, size)
+    if proc.returncode:
+        raise sp.CalledProcessError(proc.returncode, command)
+    return buffer[:size // buffer.itemsize]
+
+
 class AudioFile:
     """
     Allows to read audio from any format supported by ffmpeg, as well as resampling or
@@ -107,22 +139,26 @@ class AudioFile:
             target_size = int((samplerate or self.samplerate()) * duration)
             query_duration = float((target_size + 1) / (samplerate or self.samplerate()))
 
-        with temp_filenames(len(streams)) as filenames:
-            command = ['ffmpeg', '-y']
-            command += ['-loglevel', 'panic']
-            if seek_time:
-                command += ['-ss', str(seek_time)]
-            command += ['-i', str(self.path)]
-            for stream, filename in zip(streams, filenames):
-                command += ['-map', f'0:{self._audio_streams[stream]}']
-                if query_duration is not None:
-                    command += ['-t', str(query_duration)]
-                command += ['-threads', '1']
-                command += ['-f', 'f32le']
-                if samplerate is not None:
-                    command += ['-ar', str(samplerate)]
-                command += [filename]
+        if single:
+            # A single stream is piped from ffmpeg into a buffer sized from the duration,
+            # instead of going through a temporary file.
+            command = self._command(streams, ['pipe:1'], seek_time, query_duration, samplerate)
+            if query_duration is None:
+                query_duration = max(self.duration - (seek_time or 0), 0)
+            src_channels = self.channels(streams[0])
+            # One extra second, the duration reported by ffprobe is not always exact.
+            size_hint = int((query_duration + 1) * (samplerate or self.samplerate()))
+            samples = _read_pipe(command, size_hint * src_channels)
+            samples = samples[:len(samples) - len(samples) % src_channels]
+            wav = torch.from_numpy(samples).view(-1, src_channels).t()
+            if channels is not None:
+                wav = convert_audio_channels(wav, channels)
+            if target_size is not None:
+                wav = wav[..., :target_size]
+            return wav
 
+        with temp_filenames(len(streams)) as filenames:
+            command = self._command(streams, filenames, seek_time, query_duration, samplerate)
             sp.run(command, check=True)
             wavs = []
             for filename in filenames:
@@ -135,10 +171,25 @@ class AudioFile:
                     wav = wav[..., :target_size]
                 wavs.append(wav)
         wav = torch.stack(wavs, dim=0)
-        if single:
-            wav = wav[0]
         return wav
 
+    def _command(self, streams, outputs, seek_time, query_duration, samplerate):
+        command = ['ffmpeg', '-y']
+        command += ['-loglevel', 'panic']
+        if seek_time:
+            command += ['-ss', str(seek_time)]
+        command += ['-i', str(self.path)]
+        for stream, output in zip(streams, outputs):
+            command += ['-map', f'0:{self._audio_streams[stream]}']
+            if query_duration is not None:
+                command += ['-t', str(query_duration)]
+            command += ['-threads', '1']
+            command += ['-f', 'f32le']
+            if samplerate is not None:
+                command += ['-ar', str(samplerate)]
+            command += [output]
+        return command
+
 
 def convert_audio_channels(wav, channels=2):
     """Convert audio to the given number of channels."""
@@ -215,6 +266,75 @@ def encode_mp3(wav, path, samplerate=44100, bitrate=320, quality=2, verbose=Fals
         f.write(mp3_data)
 
 
+class Mp3StreamWriter:
+    """Incrementally encode audio to an mp3 file. Frames are appended and flushed as
+    soon as they are encoded, so the file can be played while it is being written.
+
+    Encoding runs on a background thread owned by the writer, in the order of the
+    `write` calls, so the caller (e.g. the separation) is not blocked by LAME and
+    several writers encode in parallel. Use `wait` to make sure everything written
+    so far is on disk."""
+    def __init__(self, path, samplerate=44100, channels=2, bitrate=320, quality=2,
+                 verbose=False):
+        self.path = Path(path)
+        self.encoder = lameenc.Encoder()
+        self.encoder.set_bit_rate(bitrate)
+        self.encoder.set_in_sample_rate(samplerate)
+        self.encoder.set_channels(channels)
+        self.encoder.set_quality(quality)  # 2-highest, 7-fastest
+        if not verbose:
+            self.encoder.silence()
+        self._file = open(self.path, "wb")
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="mp3")
+        self._pending: tp.Deque[Future] = deque()
+
+    def write(self, wav):
+        """Append the [C, T] audio to the stream."""
+        # Convert on the calling thread, the caller is free to reuse `wav` afterwards.
+        wav = i16_pcm(wav).data.cpu()
+        data = wav.transpose(0, 1).numpy().tobytes()
+        # Raise errors of the previous frames as soon as they are known.
+        while self._pending and self._pending[0].done():
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(self._encode, data))
+
+    def _encode(self, data: bytes):
+        self._file.write(self.encoder.encode(data))
+        self._file.flush()
+
+    def wait(self):
+        """Block until everything written so far is encoded and on disk."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self.wait()
+            self._file.write(self.encoder.flush())
+        finally:
+            self._executor.shutdown()
+            self._file.close()
+
+
+def encode_aac(wav, path, samplerate=44100, bitrate=96, out_samplerate=None, channels=None):
+    """Save given audio as AAC in an mp4 container (.m4a) with ffmpeg. The PCM is piped to
+    ffmpeg, and the moov atom is moved to the front so playback can start before the
+    whole file is downloaded."""
+    C, T = wav.shape
+    data = f32_pcm(wav).data.cpu().transpose(0, 1).contiguous().numpy().tobytes()
+    command = ['ffmpeg', '-y', '-loglevel', 'panic']
+    command += ['-f', 'f32le', '-ar', str(samplerate), '-ac', str(C), '-i', 'pipe:0']
+    command += ['-c:a', 'aac', '-b:a', f'{bitrate}k']
+    if out_samplerate is not None:
+        command += ['-ar', str(out_samplerate)]
+    if channels is not None:
+        command += ['-ac', str(channels)]
+    command += ['-movflags', '+faststart', '-f', 'mp4', str(path)]
+    sp.run(command, input=data, check=True)
+
+
 def prevent_clip(wav, mode='rescale'):
     """
     different strategies for avoiding raw clipping.
@@ -261,5 +381,7 @@ def save_audio(wav: torch.Tensor,
                 encoding=encoding, bits_per_sample=bits_per_sample)
     elif suffix == ".flac":
         ta.save(str(path), wav, sample_rate=samplerate, bits_per_sample=bits_per_sample)
+    elif suffix == ".m4a":
+        encode_aac(wav, path, samplerate, bitrate)
     else:
         raise ValueError(f"Invalid suffix for path: {suffix}")
@@ -0,0 +1,90 @@
+"""
+Ahead-of-time compiled forward pass for a fixed input shape.
+
+`apply_model` feeds the model chunks of a fixed length, so the graph of the forward
+pass (STFT, encoders, transformer, masking, iSTFT) can be captured once for that shape.
+The model is exported with `torch.export` and saved as a `.pt2` artifact, reloading it
+skips both tracing and the Python overhead of the forward. Models that cannot be
+exported fall back to `torch.compile`, whose compiled kernels are cached on disk.
+
+The compiled forward is attached to the model as `model.exported`, `apply_model` uses it
+for the chunks whose shape matches and runs the eager model for the others.
+"""
+import logging
+import os
+from pathlib import Path
+import typing as tp
+
+import torch as th
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+
+class ExportedModel:
+    """
+    Compiled forward of a model for inputs of shape `shape` (batch, channels, length).
+    Not an `nn.Module`, so attaching it to the model does not register its weights twice.
+    """
+
+    def __init__(self, forward: tp.Callable[..., th.Tensor], shape: tp.Sequence[int],
+                 stem: tp.Optional[int], kind: str):
+        self.forward = forward
+        self.shape = tuple(shape)
+        self.stem = stem
+        self.kind = kind
+
+    def matches(self, mix: th.Tensor, stem: tp.Optional[int]) -> bool:
+        return stem == self.stem and tuple(mix.shape) == self.shape
+
+    def __call__(self, mix: th.Tensor) -> th.Tensor:
+        kwargs = {} if self.stem is None else {"stem": self.stem}
+        return self.forward(mix, **kwargs)
+
+
+def artifact_path(cache_dir: tp.Union[str, Path], name: str, device: str,
+                  shape: tp.Sequence[int], stem: tp.Optional[int]) -> Path:
+    dims = "x".join(str(dim) for dim in shape)
+    return Path(cache_dir, f"{name}-{device}-{dims}-stem{stem}.pt2")
+
+
+def export_model(model: nn.Module, name: str, length: int, batch: int, device: str,
+                 cache_dir: tp.Union[str, Path],
+                 stem: tp.Optional[int] = None) -> ExportedModel:
+    """
+    Build, or load from `cache_dir`, the compiled forward of `model` for inputs of shape
+    [batch, model.audio_channels, length] and attach it as `model.exported`. Artifacts are
+    only valid for the weights and the torch version that produced them, `name` must
+    change with both.
+    """
+    shape = (batch, model.audio_channels, length)
+    path = artifact_path(cache_dir, name, device, shape, stem)
+    kwargs = {} if stem is None else {"stem": stem}
+    exported: tp.Optional[ExportedModel] = None
+    if path.exists():
+        try:
+            program = th.export.load(str(path))
+            exported = ExportedModel(program.module(), shape, stem, "export")
+        except Exception as error:
+            logger.warning("Could not load %s, rebuilding it: %s", path, error)
+    if exported is None:
+        example = th.zeros(shape, device=device)
+        try:
+            with th.no_grad():
+                program = th.export.export(model, (example,), kwargs)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            th.export.save(program, str(tmp))
+            os.replace(tmp, path)
+            exported = ExportedModel(program.module(), shape, stem, "export")
+        except Exception as error:
+            logger.warning("torch.export failed, falling back to torch.compile: %s", error)
+            # Inductor reads the cache location when compiling, keep it next to the
+            # exported artifacts so it survives restarts.
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(Path(cache_dir, "inductor")))
+            compiled = th.compile(model, dynamic=False)
+            with th.no_grad():
+                compiled(example, **kwargs)
+            exported = ExportedModel(compiled, shape, stem, "compile")
+    model.exported = exported
+    return exported
@@ -9,7 +9,6 @@ This code contains the spectrogram and Hybrid version of Demucs.
 """
 import math
 
-from openunmix.filtering import wiener
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -20,7 +19,9 @@ from .transformer import CrossTransformerEncoder
 
 from .demucs import rescale_module
 from .states import capture_init
-from .spec import spectro, ispectro
+from .spec import spectro, ispectro, scratch_buffer
+from .utils import two_stems
+from .wiener import wiener
 from .hdemucs import pad1d, ScaledEmbedding, HEncLayer, MultiWrap, HDecLayer
 
 
@@ -441,8 +442,19 @@ class HTDemucs(nn.Module):
 
     def _ispec(self, z, length=None, scale=0):
         hl = self.hop_length // (4**scale)
-        z = F.pad(z, (0, 0, 0, 1))
-        z = F.pad(z, (2, 2))
+        # Add an empty frequency bin and 2 empty frames on each side.
+        if (torch.is_grad_enabled() or torch.compiler.is_compiling()
+                or torch.compiler.is_exporting()):
+            z = F.pad(z, (2, 2, 0, 1))
+        else:
+            # At eager inference, copy into a buffer that is reused for every chunk.
+            *other, freqs, frames = z.shape
+            padded = scratch_buffer("ispec", (*other, freqs + 1, frames + 4), z.device, z.dtype)
+            padded[..., freqs, :] = 0
+            padded[..., :2] = 0
+            padded[..., -2:] = 0
+            padded[..., :freqs, 2: 2 + frames] = z
+            z = padded
         pad = hl // 2 * 3
         le = hl * int(math.ceil(length / hl)) + 2 * pad
         x = ispectro(z, hl, length=le)
@@ -478,30 +490,24 @@ class HTDemucs(nn.Module):
             return self._wiener(m, z, niters)
 
     def _wiener(self, mag_out, mix_stft, niters):
-        # apply wiener filtering from OpenUnmix.
+        # apply wiener filtering from OpenUnmix, on all the windows of all the
+        # batch items at once.
         init = mix_stft.dtype
         wiener_win_len = 300
         residual = self.wiener_residual
 
         B, S, C, Fq, T = mag_out.shape
-        mag_out = mag_out.permute(0, 4, 3, 2, 1)
-        mix_stft = torch.view_as_real(mix_stft.permute(0, 3, 2, 1))
-
-        outs = []
-        for sample in range(B):
-            pos = 0
-            out = []
-            for pos in range(0, T, wiener_win_len):
-                frame = slice(pos, pos + wiener_win_len)
-                z_out = wiener(
-                    mag_out[sample, frame],
-                    mix_stft[sample, frame],
-                    niters,
-                    residual=residual,
-                )
-                out.append(z_out.transpose(-1, -2))
-            outs.append(torch.cat(out, dim=0))
-        out = torch.view_as_complex(torch.stack(outs, 0))
+        windows = (T + wiener_win_len - 1) // wiener_win_len
+        # Padded frames are silent and don't change the statistics of the last window.
+        pad = windows * wiener_win_len - T
+        mag_out = F.pad(mag_out, (0, pad)).permute(0, 4, 3, 2, 1)
+        mix_stft = torch.view_as_complex(
+            F.pad(torch.view_as_real(mix_stft), (0, 0, 0, pad))).permute(0, 3, 2, 1)
+        mag_out = mag_out.reshape(B * windows, wiener_win_len, Fq, C, S)
+        mix_stft = mix_stft.reshape(B * windows, wiener_win_len, Fq, C)
+
+        out = wiener(mag_out, mix_stft, niters, residual=residual)
+        out = out.reshape(B, windows * wiener_win_len, Fq, C, -1)[:, :T]
         out = out.permute(0, 4, 3, 2, 1).contiguous()
         if residual:
             out = out[:, :-1]
@@ -524,7 +530,14 @@ class HTDemucs(nn.Module):
                     f"training length {training_length}")
         return training_length
 
-    def forward(self, mix):
+    def forward(self, mix, stem=None):
+        """
+        Args:
+            mix: tensor of shape [B, C, T].
+            stem (int or None): if given, only return 2 sources, the source at this index
+                and the sum of the others. They are summed before the iSTFT, so only two
+                spectrograms need to be inverted.
+        """
         length = mix.shape[-1]
         length_pre_pad = None
         if self.use_train_segment:
@@ -634,6 +647,9 @@ class HTDemucs(nn.Module):
             x = x.cpu()
 
         zout = self._mask(z, x)
+        if stem is not None:
+            # Wiener filtering needs all the sources, but the iSTFT is linear.
+            zout = two_stems(zout, stem)
         if self.use_train_segment:
             if self.training:
                 x = self._ispec(zout, length)
@@ -654,6 +670,8 @@ class HTDemucs(nn.Module):
         else:
             xt = xt.view(B, S, -1, length)
         xt = xt * stdt[:, None] + meant[:, None]
+        if stem is not None:
+            xt = two_stems(xt, stem)
         x = xt + x
         if length_pre_pad:
             x = x[..., :length_pre_pad]
@@ -11,6 +11,7 @@ from pathlib import Path
 import typing as tp
 
 from dora.log import fatal, bold
+import yaml
 
 from .hdemucs import HDemucs
 from .repo import RemoteRepo, LocalRepo, ModelOnlyRepo, BagOnlyRepo, AnyModelRepo, ModelLoadingError  # noqa
@@ -54,6 +55,21 @@ def _parse_remote_files(remote_file_list) -> tp.Dict[str, str]:
     return models
 
 
+def checkpoint_signature(name: str) -> str:
+    """Identifies the remote checkpoints behind `name`, a bag of models name or a
+    pretrained signature, by their file names (signature and checksum).
+    """
+    if name == 'demucs_unittest':
+        return name
+    models = _parse_remote_files(REMOTE_ROOT / 'files.txt')
+    if name in models:
+        signatures = [name]
+    else:
+        bag = yaml.safe_load((REMOTE_ROOT / f'{name}.yaml').read_text())
+        signatures = bag['models']
+    return '+'.join(Path(models[sig]).stem for sig in signatures)
+
+
 def get_model(name: str,
               repo: tp.Optional[Path] = None):
     """`name` must be a bag of models name or a pretrained signature
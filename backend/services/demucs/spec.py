@@ -5,8 +5,62 @@
 # LICENSE file in the root directory of this source tree.
 """Conveniance wrapper to perform STFT and iSTFT"""
 
+import threading
+import typing as tp
+
 import torch as th
 
+# Hann windows per (n_fft, device, dtype), shared by all threads.
+_windows: tp.Dict[tp.Tuple[int, th.device, th.dtype], th.Tensor] = {}
+_windows_lock = threading.Lock()
+# Scratch buffers, one per name and thread as chunks can be processed in parallel.
+_scratch = threading.local()
+
+_profile_hook: tp.Optional[tp.Callable[[str, th.Tensor], None]] = None
+
+
+def set_profile_hook(hook: tp.Optional[tp.Callable[[str, th.Tensor], None]]):
+    """Call `hook(kind, tensor)` on every tensor allocated by this module: 'window',
+    'buffer', 'stft' or 'istft'. Windows and scratch buffers should stop showing up
+    after the first chunk, `stft`/`istft` outputs are allocated on every call."""
+    global _profile_hook
+    _profile_hook = hook
+
+
+def _record(kind: str, tensor: th.Tensor):
+    if _profile_hook is not None:
+        _profile_hook(kind, tensor)
+
+
+def hann_window(n_fft: int, device: th.device, dtype: th.dtype) -> th.Tensor:
+    key = (n_fft, th.device(device), dtype)
+    window = _windows.get(key)
+    if window is None:
+        with _windows_lock:
+            window = _windows.get(key)
+            if window is None:
+                window = th.hann_window(n_fft, device=device, dtype=dtype)
+                _windows[key] = window
+                _record('window', window)
+    return window
+
+
+def scratch_buffer(name: str, shape: tp.Sequence[int], device: th.device,
+                   dtype: th.dtype) -> th.Tensor:
+    """Uninitialized tensor reused by the following calls with the same `name` on this
+    thread, as long as shape, device and dtype don't change. The content is only valid
+    until the next call, never return it or keep it for autograd."""
+    buffers = getattr(_scratch, 'buffers', None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    buffer = buffers.get(name)
+    if (buffer is None or buffer.shape != tuple(shape) or buffer.device != th.device(device)
+            or buffer.dtype != dtype):
+        buffer = th.empty(tuple(shape), device=device, dtype=dtype)
+        buffers[name] = buffer
+        _record('buffer', buffer)
+    return buffer
+
 
 def spectro(x, n_fft=512, hop_length=None, pad=0):
     *other, length = x.shape
@@ -17,12 +71,13 @@ def spectro(x, n_fft=512, hop_length=None, pad=0):
     z = th.stft(x,
                 n_fft * (1 + pad),
                 hop_length or n_fft // 4,
-                window=th.hann_window(n_fft).to(x),
+                window=hann_window(n_fft, x.device, x.dtype),
                 win_length=n_fft,
                 normalized=True,
                 center=True,
                 return_complex=True,
                 pad_mode='reflect')
+    _record('stft', z)
     _, freqs, frame = z.shape
     return z.view(*other, freqs, frame)
 
@@ -38,10 +93,11 @@ def ispectro(z, hop_length=None, length=None, pad=0):
     x = th.istft(z,
                  n_fft,
                  hop_length,
-                 window=th.hann_window(win_length).to(z.real),
+                 window=hann_window(win_length, z.device, z.real.dtype),
                  win_length=win_length,
                  normalized=True,
                  length=length,
                  center=True)
+    _record('istft', x)
     _, length = x.shape
     return x.view(*other, length)
@@ -53,6 +53,15 @@ def center_trim(tensor: torch.Tensor, reference: tp.Union[torch.Tensor, int]):
     return tensor
 
 
+def two_stems(tensor: torch.Tensor, index: int) -> torch.Tensor:
+    """
+    Reduce the sources dimension (dim 1) of `tensor` to 2 entries: the source at `index`
+    and the sum of all the other sources.
+    """
+    others = torch.cat([tensor[:, :index], tensor[:, index + 1:]], dim=1).sum(dim=1)
+    return torch.stack([tensor[:, index], others], dim=1)
+
+
 def pull_metric(history: tp.List[dict], name: str):
     out = []
     for metrics in history:
@@ -0,0 +1,84 @@
+"""
+Multichannel Wiener filtering, vectorised over windows and batch items.
+
+Same algorithm as `openunmix.filtering.wiener` (phase of the mix as initial estimate,
+then `niters` steps of expectation maximization), but it works on complex tensors with
+any number of leading dimensions, so every window of every batch item is processed with
+a handful of batched ops instead of one Python call per window.
+"""
+import math
+
+import torch
+
+
+def _invert(matrix: torch.Tensor) -> torch.Tensor:
+    """Invert a batch of small complex matrices of shape [..., C, C]."""
+    if matrix.shape[-1] == 2:
+        # Closed form, much faster than `linalg.inv` on millions of 2x2 matrices.
+        a, b = matrix[..., 0, 0], matrix[..., 0, 1]
+        c, d = matrix[..., 1, 0], matrix[..., 1, 1]
+        inv_det = 1 / (a * d - b * c)
+        inverse = torch.empty_like(matrix)
+        inverse[..., 0, 0] = d * inv_det
+        inverse[..., 0, 1] = -b * inv_det
+        inverse[..., 1, 0] = -c * inv_det
+        inverse[..., 1, 1] = a * inv_det
+        return inverse
+    return torch.linalg.inv(matrix)
+
+
+def expectation_maximization(y: torch.Tensor, mix: torch.Tensor, iterations: int,
+                             eps: float = 1e-10) -> torch.Tensor:
+    """
+    Args:
+        y: initial estimates of the sources, complex tensor of shape [N, T, F, C, S].
+        mix: complex mixture of shape [N, T, F, C].
+        iterations: number of EM steps.
+
+    Returns:
+        The refined estimates, same shape as `y`. The spatial covariance of each source
+        is estimated over the T frames of each of the N items independently.
+    """
+    channels = mix.shape[-1]
+    regularization = math.sqrt(eps) * torch.eye(channels, dtype=mix.dtype, device=mix.device)
+    for _ in range(iterations):
+        # Power spectral density of each source, averaged over channels: [N, T, F, S].
+        v = y.abs().square().mean(dim=-2)
+        # Spatial covariance matrices, weighted by the PSD: [N, F, S, C, C].
+        weight = eps + v.sum(dim=1)
+        R = torch.einsum("ntfcs,ntfds->nfscd", y, y.conj()) / weight[..., None, None]
+        v = v.to(R.dtype)
+        # Covariance of the mix and its inverse: [N, T, F, C, C].
+        Cxx = torch.einsum("ntfs,nfscd->ntfcd", v, R) + regularization
+        inv_x = torch.einsum("ntfde,ntfe->ntfd", _invert(Cxx), mix)
+        # Multichannel Wiener gain v_j R_j inv(Cxx) applied to the mix.
+        y = torch.einsum("ntfs,nfscd,ntfd->ntfcs", v, R, inv_x)
+    return y
+
+
+def wiener(targets: torch.Tensor, mix: torch.Tensor, iterations: int = 1,
+           residual: bool = False, scale_factor: float = 10.,
+           eps: float = 1e-10) -> torch.Tensor:
+    """
+    Args:
+        targets: magnitude estimates of the sources, real tensor of shape [N, T, F, C, S].
+        mix: complex mixture of shape [N, T, F, C].
+        iterations: number of EM steps, 0 only applies the phase of the mix.
+        residual: add an extra source for the residual `mix - sum(sources)`.
+
+    Returns:
+        Complex tensor of shape [N, T, F, C, S] (S + 1 with `residual`).
+        Each of the N items is filtered on its own, as if passed to
+        `openunmix.filtering.wiener` separately.
+    """
+    y = torch.polar(targets, torch.angle(mix)[..., None].expand_as(targets))
+    if residual:
+        y = torch.cat([y, mix[..., None] - y.sum(dim=-1, keepdim=True)], dim=-1)
+    if iterations == 0:
+        return y
+
+    # Keep the values in a reasonable range for the matrix inversions, per item.
+    max_abs = (mix.abs().amax(dim=(1, 2, 3)) / scale_factor).clamp_min(1.)
+    max_abs = max_abs[:, None, None, None]
+    y = expectation_maximization(y / max_abs[..., None], mix / max_abs, iterations, eps)
+    return y * max_abs[..., None]
@@ -1,10 +1,10 @@
 
-from managers.redis import get_redis
-from interfaces.jam import RedisJamInterface
-interface = RedisJamInterface(get_redis())
+from managers.db import get_async_db
+from interfaces.jam import AsyncRedisJamInterface
+interface = AsyncRedisJamInterface(get_async_db())
 
 
-def handle_message(message):
+async def handle_message(message):
     """
     Handle incoming messages from the Redis queue.
     """
@@ -20,4 +20,4 @@ def handle_message(message):
     if op:
         print("Received jam op:", op)
     data = message.get("data")
-    interface.create_or_update_jam_state(room_id, data)
+    await interface.create_or_update_jam_state(room_id, data)
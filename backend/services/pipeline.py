@@ -0,0 +1,250 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from managers.model import get_device, get_model_manager
+from services.demucs import spec
+from services.voice_remover import (discard_stem_streams, finish_stem_streams, get_stem_paths,
+                                    load_mix, open_stem_streams, save_stem_segments,
+                                    save_stem_variants, save_stems, separate_mix)
+
+
+class SeparationJob:
+    """
+    A track going through the separation pipeline, with the time spent in each stage.
+    `future` resolves to the timings once the stems are saved, or to the exception that
+    made the separation fail.
+    """
+
+    def __init__(self, sid: str,
+                 on_progress: Optional[Callable[[float, float], None]] = None,
+                 on_playable: Optional[Callable[[], None]] = None,
+                 on_done: Optional[Callable[[], None]] = None,
+                 stream: bool = True):
+        self.sid = sid
+        self.on_progress = on_progress
+        self.on_playable = on_playable
+        self.on_done = on_done
+        self.stream = stream
+        self.model: Any = None
+        self.mix: Any = None
+        self.stems: Any = None
+        self.writers: list = []
+        self.timings: dict[str, float] = {}
+        self.future: Future[dict[str, float]] = Future()
+        self._stage_start = time.perf_counter()
+
+    def stage_done(self, stage: str):
+        now = time.perf_counter()
+        self.timings[stage] = now - self._stage_start
+        self._stage_start = now
+
+
+class SeparationPipeline:
+    """
+    Overlaps the stages of separating a track:
+
+        decode (ffmpeg) -> inference (model) -> encode (both stems in parallel)
+
+    Each stage runs on its own thread and hands jobs over through bounded queues,
+    so the next track is decoded while the current one is in inference and the
+    previous one is being encoded. `submit` blocks when the pipeline is full, which
+    keeps at most a couple of decoded tracks in memory.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(SeparationPipeline, cls).__new__(
+                        cls, *args, **kwargs)
+                    cls._instance._initialize_pipeline()
+        return cls._instance
+
+    def _initialize_pipeline(self):
+        self.model_name = os.getenv("SEPARATION_MODEL", "htdemucs")
+        self.precision = os.getenv("SEPARATION_PRECISION", "float32")
+        self.device = get_device(self.precision)
+        # LAME quality preset, 2 (best) to 7 (fastest).
+        self.mp3_preset = int(os.getenv("SEPARATION_MP3_PRESET", 2))
+        # Compact renditions encoded besides the mp3, e.g. "aac,preview".
+        self.variants = [variant for variant in os.getenv("SEPARATION_VARIANTS", "").split(",")
+                         if variant]
+        self.hls = os.getenv("SEPARATION_HLS", "0") == "1"
+        # Count the tensors allocated for the spectrograms, reported in `stats`.
+        self.profile = os.getenv("SEPARATION_PROFILE", "0") == "1"
+        self.allocations: Counter[str] = Counter()
+        self.allocated_bytes: Counter[str] = Counter()
+        self._allocations_lock = threading.Lock()
+        if self.profile:
+            spec.set_profile_hook(self._record_allocation)
+        self._decode_queue: queue.Queue[Optional[SeparationJob]] = queue.Queue(maxsize=1)
+        self._infer_queue: queue.Queue[Optional[SeparationJob]] = queue.Queue(maxsize=1)
+        self._encode_queue: queue.Queue[Optional[SeparationJob]] = queue.Queue(maxsize=1)
+        # One thread per stem, so vocals and instrumental are encoded in parallel.
+        self._stem_pool = ThreadPoolExecutor(2, thread_name_prefix="encode")
+        self._pending: set[SeparationJob] = set()
+        self._pending_lock = threading.Condition()
+        self.totals: dict[str, float] = {}
+        self.completed = 0
+        self._threads = [
+            threading.Thread(target=self._decode_worker, name="decode", daemon=True),
+            threading.Thread(target=self._infer_worker, name="infer", daemon=True),
+            threading.Thread(target=self._encode_worker, name="encode", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: SeparationJob) -> None:
+        """
+        Queue a track for separation. Blocks while the decode stage is busy.
+        """
+        with self._pending_lock:
+            self._pending.add(job)
+        self._decode_queue.put(job)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every submitted job is done. Returns False on timeout.
+        """
+        with self._pending_lock:
+            return self._pending_lock.wait_for(lambda: not self._pending, timeout)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns the number of completed jobs and the average time spent per stage, and
+        the spectrogram allocations per kind when profiling.
+        """
+        stats: dict[str, Any] = {
+            "completed": self.completed,
+            "pending": len(self._pending),
+            "average": {stage: total / max(self.completed, 1)
+                        for stage, total in self.totals.items()},
+        }
+        if self.profile:
+            stats["allocations"] = {kind: {"count": count, "bytes": self.allocated_bytes[kind]}
+                                    for kind, count in self.allocations.items()}
+        return stats
+
+    def _record_allocation(self, kind: str, tensor):
+        # Called from the inference threads, Counter updates are not atomic.
+        with self._allocations_lock:
+            self.allocations[kind] += 1
+            self.allocated_bytes[kind] += tensor.numel() * tensor.element_size()
+
+    def _decode_worker(self):
+        model_manager = get_model_manager()
+        while True:
+            job = self._decode_queue.get()
+            if job is None:
+                break
+            try:
+                job.stage_done("wait_decode")
+                job.model = model_manager.get_model(self.model_name, self.device,
+                                                    precision=self.precision)
+                job.mix = load_mix(job.sid, job.model)
+                job.stage_done("decode")
+                if job.mix is None:
+                    self._fail(job, FileNotFoundError(f"No raw audio for {job.sid}"))
+                    continue
+                self._infer_queue.put(job)
+            except Exception as e:
+                self._fail(job, e)
+
+    def _infer_worker(self):
+        while True:
+            job = self._infer_queue.get()
+            if job is None:
+                break
+            try:
+                job.stage_done("wait_infer")
+                paths = get_stem_paths(job.sid)
+                if job.stream:
+                    job.writers = open_stem_streams(paths, job.model,
+                                                    mp3_preset=self.mp3_preset)
+                wav, ref = job.mix
+                try:
+                    job.stems = separate_mix(job.model, wav, ref,
+                                             on_progress=job.on_progress,
+                                             writers=job.writers,
+                                             on_playable=job.on_playable,
+                                             device=self.device)
+                except Exception:
+                    discard_stem_streams(job.writers)
+                    raise
+                job.mix = None
+                job.stage_done("infer")
+                self._encode_queue.put(job)
+            except Exception as e:
+                self._fail(job, e)
+
+    def _encode_worker(self):
+        while True:
+            job = self._encode_queue.get()
+            if job is None:
+                break
+            try:
+                job.stage_done("wait_encode")
+                paths = get_stem_paths(job.sid)
+                # Streamed stems were clamped, the peak of the track was unknown.
+                clip_mode = "clamp" if job.writers else "rescale"
+                if job.writers:
+                    finish_stem_streams(job.writers, paths)
+                else:
+                    save_stems(job.stems, paths, job.model.samplerate, pool=self._stem_pool,
+                               clip=clip_mode, preset=self.mp3_preset)
+                save_stem_variants(job.stems, job.sid, job.model.samplerate, self.variants,
+                                   pool=self._stem_pool, clip_mode=clip_mode)
+                if self.hls:
+                    save_stem_segments(job.sid, pool=self._stem_pool)
+                job.stems = None
+                job.stage_done("encode")
+                self._finish(job)
+            except Exception as e:
+                discard_stem_streams(job.writers)
+                self._fail(job, e)
+
+    def _finish(self, job: SeparationJob):
+        timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in job.timings.items())
+        print(f"Separation of {job.sid} done: {timings}")
+        if self.profile:
+            print(f"Pipeline stats: {self.stats()}")
+        if job.on_done is not None:
+            job.on_done()
+        self._release(job)
+        self.completed += 1
+        for stage, seconds in job.timings.items():
+            self.totals[stage] = self.totals.get(stage, 0.) + seconds
+        job.future.set_result(job.timings)
+
+    def _fail(self, job: SeparationJob, error: BaseException):
+        print(f"Separation of {job.sid} failed:")
+        traceback.print_exception(error)
+        job.mix = job.stems = None
+        self._release(job)
+        job.future.set_exception(error)
+
+    def _release(self, job: SeparationJob):
+        with self._pending_lock:
+            self._pending.discard(job)
+            self._pending_lock.notify_all()
+
+
+def get_pipeline():
+    return SeparationPipeline()
+
+
+def join_pipeline(timeout: Optional[float] = None) -> bool:
+    """
+    Wait for the jobs of this process' pipeline, without starting one if it was never used.
+    """
+    if SeparationPipeline._instance is None:
+        return True
+    return SeparationPipeline._instance.join(timeout)
@@ -1,16 +1,21 @@
 import json
 import os
+import time
 from celery.result import AsyncResult
 from pathlib import Path
 from typing import Any, Union
 
 from celery import Celery
+from celery.signals import worker_init, worker_shutdown
 import redis
 from utils import NO_VOCALS_DIR, LYRICS_DIR, VOCALS_DIR, RAW_AUDIO_DIR
 from models.track import Artist, Track
+from interfaces.queue import READY_TRACKS_KEY, progress_channel
 from managers.websocket import WebSocketManager
 from services.downloader import download_lyrics, download_audio
-from services.voice_remover import separate_vocals
+from services.voice_remover import get_batch_size, separate_vocals
+from services.pipeline import SeparationJob, get_pipeline, join_pipeline
+from managers.model import get_model_manager
 
 ws_manager = WebSocketManager()
 
@@ -20,6 +25,75 @@ celery = Celery("worker", broker=redis_uri, backend=redis_uri)
 r = redis.Redis(host=os.getenv("REDIS_HOST", "localhost"),
                 port=int(os.getenv("REDIS_PORT", 6379)))
 
+# Separation progress is published at most every PROGRESS_INTERVAL seconds, and only
+# once it moved by at least PROGRESS_DELTA (fraction of the track).
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.5))
+PROGRESS_DELTA = float(os.getenv("PROGRESS_DELTA", 0.02))
+
+
+@worker_init.connect
+def warmup_model(**kwargs):
+    """
+    Load the separation model once when the worker starts, so the first track
+    doesn't pay for checkpoint deserialization.
+    """
+    name = os.getenv("SEPARATION_MODEL", "htdemucs")
+    precision = os.getenv("SEPARATION_PRECISION", "float32")
+    manager = get_model_manager()
+    manager.warmup(name, precision=precision)
+    if os.getenv("SEPARATION_EXPORT", "0") == "1" and precision == "float32":
+        # Compile the forward pass for the chunk shape used by the pipeline, the
+        # artifact is cached on disk so only the first worker pays for it.
+        manager.export(name, batch=get_batch_size(manager.get_model(name)))
+
+
+@worker_shutdown.connect
+def drain_pipeline(**kwargs):
+    """
+    Let the tracks in the separation pipeline finish before exiting.
+    """
+    join_pipeline()
+
+
+class ProgressThrottle:
+    """
+    Rate limits the progress updates of a track. `apply_model` reports every chunk,
+    which is way more than the clients need to draw a progress bar.
+    """
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL, delta: float = PROGRESS_DELTA):
+        self.interval = interval
+        self.delta = delta
+        self._last_time = 0.
+        self._last_value = -1.
+
+    def should_publish(self, progress: float, total: float) -> bool:
+        value = progress / total if total else 0.
+        now = time.monotonic()
+        # The last update is always sent, so the progress bar ends full.
+        if value < 1 and (now - self._last_time < self.interval
+                          or value - self._last_value < self.delta):
+            return False
+        self._last_time = now
+        self._last_value = value
+        return True
+
+
+def publish_progress(track_id: str, status: str, **fields):
+    """
+    Publish the status of a track for the API processes. The message only carries the
+    track id, the clients already know the rest of the track.
+    """
+    r.publish(progress_channel(track_id), json.dumps({
+        "type": "notify",
+        "data": {
+            "action": "progress",
+            "track": {"id": track_id},
+            "status": status,
+            **fields,
+        },
+    }))
+
 
 def is_ready(track: Track) -> bool:
     """
@@ -40,11 +114,26 @@ def send_process_request(track: Track) -> AsyncResult:
     return celery.send_task("process_request", args=[track.model_dump()])
 
 
-@celery.task(name="process_request")
+@celery.task(name="process_request", acks_late=True, reject_on_worker_lost=True)
 def process_request(track: Union[dict[str, Any], Track]):
+    """
+    Download and separate a track. The task waits for the separation, so its result is
+    the outcome of the whole processing, and it is only acknowledged once done: a track
+    queued on a worker that dies is delivered again. Run the worker with a threads pool
+    (`--pool=threads --concurrency=2`) so the next track is downloaded while the current
+    one is in the separation pipeline, which is shared by the threads of the process.
+    """
     if isinstance(track, dict):
         track = Track(**track)
     print("Processing request for track:", track)
+    try:
+        process_track(track)
+    except Exception:
+        fail_request(track)
+        raise
+
+
+def process_track(track: Track):
     search_term = f"{track.name} {' '.join(map(lambda artist: artist.name, track.artists))}"
     lyrics_exist = Path(LYRICS_DIR, f"{track.id}.lrc").exists()
     vocals_exist = Path(VOCALS_DIR, f"{track.id}.mp3").exists()
@@ -52,63 +141,58 @@ def process_request(track: Union[dict[str, Any], Track]):
 
     if not lyrics_exist:
 
-        r.publish(track.id, json.dumps({
-            "type": "notify",
-            "data": {
-                "action": "progress",
-                "track": track.model_dump(),
-                "status": "downloading_lyrics",
-            },
-        }))
+        publish_progress(track.id, "downloading_lyrics")
         download_lyrics(track.id, search_term)
 
     if not vocals_exist or not non_vocals_exist:
-        r.publish(track.id, json.dumps({
-            "type": "notify",
-            "data": {
-                "action": "progress",
-                "track": track.model_dump(),
-                "status": "downloading_audio",
-            },
-        }))
+        publish_progress(track.id, "downloading_audio")
         download_audio(track.id, search_term)
 
-        r.publish(track.id, json.dumps({
-            "type": "notify",
-            "data": {
-                "action": "progress",
-                "track": track.model_dump(),
-                "status": "separating",
-            },
-        }))
+        publish_progress(track.id, "separating")
+        throttle = ProgressThrottle()
 
         def on_progress(progress: float, total: float):
             """
             Callback function to handle progress updates during vocal separation.
             """
-            r.publish(track.id, json.dumps({
-                "type": "notify",
-                "data": {
-                    "action": "progress",
-                    "track": track.model_dump(),
-                    "status": "separating",
-                    "value": progress,
-                    "total": total
-                },
-            }))
-        # If the audio is not downloaded, we will wait for it to finish before starting the separation
-        separate_vocals(track.id, on_progress=on_progress)
+            if throttle.should_publish(progress, total):
+                publish_progress(track.id, "separating", value=progress, total=total)
+
+        def on_playable():
+            """
+            Callback function to let the clients know the stems can be played while
+            the separation is still running.
+            """
+            publish_progress(track.id, "separating", playable=True)
+
+        # Blocks while the pipeline is full, then until the stems are saved. Raises
+        # the error of the separation if it failed.
+        job = SeparationJob(track.id, on_progress=on_progress, on_playable=on_playable)
+        get_pipeline().submit(job)
+        job.future.result()
+
+    finish_request(track)
+
+
+def finish_request(track: Track):
+    """
+    Clean up the raw audio and let the clients know the track is ready.
+    """
+    if os.path.exists(Path(RAW_AUDIO_DIR, f"{track.id}.mp3")):
+        os.remove(Path(RAW_AUDIO_DIR, f"{track.id}.mp3"))
+    # e.g. no lyrics were found, the track is still playable but not listed as ready.
+    if is_ready(track):
+        r.sadd(READY_TRACKS_KEY, track.id)
+    publish_progress(track.id, "ready")
 
+
+def fail_request(track: Track):
+    """
+    Clean up the raw audio and let the clients know the track could not be processed.
+    """
     if os.path.exists(Path(RAW_AUDIO_DIR, f"{track.id}.mp3")):
         os.remove(Path(RAW_AUDIO_DIR, f"{track.id}.mp3"))
-    r.publish(track.id, json.dumps({
-        "type": "notify",
-        "data": {
-                "action": "progress",
-                "track": track.model_dump(),
-                "status": "ready"
-        },
-    }))
+    publish_progress(track.id, "error")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,19 @@
-import argparse
+from concurrent.futures import Executor, ThreadPoolExecutor
 from logging import fatal
 import sys
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 import os
+import shutil
+import subprocess as sp
 import typing
 import torch as th
 
-from utils import NO_VOCALS_DIR, RAW_AUDIO_DIR, VOCALS_DIR
-from services.demucs.apply import apply_model, BagOfModels
-from services.demucs.audio import save_audio
-from services.demucs.pretrained import get_model_from_args
+from utils import AUDIO_VARIANTS, NO_VOCALS_DIR, RAW_AUDIO_DIR, VOCALS_DIR, get_hls_dir
+from services.demucs.apply import apply_model, batch_size_for_memory, BagOfModels
+from services.demucs.audio import Mp3StreamWriter, encode_aac, prevent_clip, save_audio
 from services.demucs.repo import ModelLoadingError
+from managers.model import get_device, get_model_manager
 from services.demucs.separate import load_track
 
 
@@ -21,10 +23,240 @@ async def async_separate_vocals(sid: str, model_name: str = "htdemucs",
                                 float32: bool = False, clip_mode: str = "rescale",
                                 mp3: bool = True, mp3_bitrate: int = 320,
                                 verbose: bool = True,
-                                on_progress: typing.Optional[typing.Callable[[float, float], None]] = None):
+                                on_progress: typing.Optional[typing.Callable[[float, float], None]] = None,
+                                model: Any = None, stream: bool = False,
+                                on_playable: typing.Optional[typing.Callable[[], None]] = None,
+                                precision: str = "float32", mp3_preset: int = 2):
     """Asynchronous wrapper for separate_vocals function."""
     separate_vocals(sid, model_name, shifts, overlap, stem, int24,
-                    float32, clip_mode, mp3, mp3_bitrate, verbose, on_progress)
+                    float32, clip_mode, mp3, mp3_bitrate, verbose, on_progress, model,
+                    stream, on_playable, precision, mp3_preset)
+
+
+def get_stem_paths(sid: str, ext: str = "mp3") -> tuple[Path, Path]:
+    """Returns the output paths of the vocals and the instrumental for the song ID."""
+    vocal_stem = Path(VOCALS_DIR) / f"{sid}.{ext}"
+    vocal_stem.parent.mkdir(parents=True, exist_ok=True)
+    non_vocal_stem = Path(NO_VOCALS_DIR) / f"{sid}.{ext}"
+    non_vocal_stem.parent.mkdir(parents=True, exist_ok=True)
+    return vocal_stem, non_vocal_stem
+
+
+def load_mix(sid: str, model: Any) -> Optional[tuple[th.Tensor, th.Tensor]]:
+    """Decode the raw audio of the song ID and normalize it for the model.
+
+    Returns:
+        The normalized waveform and the reference used to undo the normalization,
+        or None if the raw audio does not exist.
+    """
+    track = Path(RAW_AUDIO_DIR, f"{sid}.mp3")
+    if not track.exists():
+        print(
+            f"File {track} does not exist. If the path contains spaces, "
+            'please try again after surrounding the entire path with quotes "".',
+            file=sys.stderr,
+        )
+        return None
+    print(f"Separating track {track}")
+    wav = load_track(track, model.audio_channels, model.samplerate)
+
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+    return wav, ref
+
+
+def open_stem_streams(paths: tuple[Path, Path], model: Any, mp3_bitrate: int = 320,
+                      mp3_preset: int = 2) -> list[Mp3StreamWriter]:
+    """Open `{sid}.partial.mp3` writers next to the given stem paths. Each writer
+    encodes on its own thread."""
+    return [Mp3StreamWriter(path.with_name(path.name.replace(".mp3", ".partial.mp3")),
+                            model.samplerate, model.audio_channels, mp3_bitrate, mp3_preset)
+            for path in paths]
+
+
+def finish_stem_streams(writers: list[Mp3StreamWriter], paths: tuple[Path, Path]):
+    """Flush the streamed stems and move them to their final paths."""
+    for writer, path in zip(writers, paths):
+        writer.close()
+        os.replace(writer.path, path)
+
+
+def discard_stem_streams(writers: list[Mp3StreamWriter]):
+    """Close the writers and remove their partial stems, after a failed separation.
+    Writers that fail to close, or whose file was already moved, are skipped."""
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            print(f"Error closing stem stream {writer.path}: {e}")
+        Path(writer.path).unlink(missing_ok=True)
+
+
+def get_batch_memory() -> Optional[int]:
+    """Memory budget (bytes) for batched chunk inference, stacking segments into a single
+    forward pass is much faster than one pass per segment on a thread pool.
+    Set SEPARATION_BATCH_MEMORY_MB to 0 to disable batching."""
+    batch_memory_mb = int(os.environ.get("SEPARATION_BATCH_MEMORY_MB", 2048))
+    return batch_memory_mb * 2**20 if batch_memory_mb > 0 else None
+
+
+def get_batch_size(model: Any) -> int:
+    """Number of segments `separate_mix` runs per forward pass with this model."""
+    max_batch_memory = get_batch_memory()
+    if max_batch_memory is None or isinstance(model, BagOfModels):
+        return 1
+    return batch_size_for_memory(model, int(model.segment * model.samplerate), 1,
+                                 max_batch_memory)
+
+
+def separate_mix(
+    model: Any,
+    wav: th.Tensor,
+    ref: th.Tensor,
+    stem: str = "vocals",
+    shifts: int = 1,
+    overlap: float = 0.5,
+    on_progress: typing.Optional[typing.Callable[[
+        float, float], None]] = None,
+    writers: typing.Optional[list[Mp3StreamWriter]] = None,
+    on_playable: typing.Optional[typing.Callable[[], None]] = None,
+    device: typing.Optional[str] = None,
+) -> th.Tensor:
+    """Run the model on a mix returned by `load_mix`.
+
+    Args:
+        device: Device to run the model on, defaults to `get_device()`.
+        writers: If given, the (stem, no_stem) audio is encoded to these writers while
+                 the separation runs, see `open_stem_streams`.
+        on_playable: Called once the first stretch is written to `writers`.
+
+    Returns:
+        Tensor of shape [2, C, T] with {STEM} and no_{STEM}.
+    """
+    if os.environ.get("LIMIT_CPU", False):
+        th.set_num_threads(1)
+        jobs = 1
+    else:
+        # Number of jobs. This can increase memory usage but will be much faster when
+        # multiple cores are available.
+        jobs = os.cpu_count()
+
+    # The model returns (stem, sum of the other sources), each source was normalized
+    # against `ref`, so the offset is added once per summed source.
+    offset = th.tensor([1., len(model.sources) - 1.])[:, None, None] * ref.mean()
+
+    def denormalize(stems: th.Tensor) -> th.Tensor:
+        return stems * ref.std() + offset.to(stems)
+
+    on_chunk = None
+    if writers:
+        def on_chunk(chunk: th.Tensor, start: int):
+            vocals, others = denormalize(chunk[0])
+            # The peak of the whole track is unknown yet, clamp instead of rescale.
+            writers[0].write(prevent_clip(vocals, mode="clamp"))
+            writers[1].write(prevent_clip(others, mode="clamp"))
+            if start == 0 and on_playable is not None:
+                for writer in writers:
+                    writer.wait()
+                on_playable()
+
+    sources = apply_model(
+        model,
+        wav[None],
+        device=device or get_device(),
+        shifts=shifts,
+        split=True,
+        overlap=overlap,
+        progress=True,
+        on_progress=on_progress,
+        num_workers=jobs or 1,
+        max_batch_memory=get_batch_memory(),
+        on_chunk=on_chunk,
+        stem=stem,
+    )[0]
+    return denormalize(sources)
+
+
+# Encoder settings of the compact renditions, on top of the mp3. Bitrates in kbps.
+VARIANT_SETTINGS: dict[str, dict[str, Any]] = {
+    "aac": {"bitrate": 96},
+    "preview": {"bitrate": 32, "out_samplerate": 22050, "channels": 1},
+}
+
+
+def save_stem_variants(stems: th.Tensor, sid: str, samplerate: int,
+                       variants: typing.Sequence[str], pool: Optional[Executor] = None,
+                       clip_mode: str = "rescale"):
+    """Encode the [2, C, T] output of `separate_mix` to each of the given renditions of
+    `AUDIO_VARIANTS` besides mp3, e.g. `{sid}.m4a` and `{sid}.preview.m4a`. Pass the
+    `clip_mode` of the mp3, so that every rendition of a stem has the same loudness."""
+    tasks = []
+    for variant in variants:
+        paths = get_stem_paths(sid, AUDIO_VARIANTS[variant][0])
+        for wav, path in zip(stems, paths):
+            tasks.append((prevent_clip(wav, mode=clip_mode), path, VARIANT_SETTINGS[variant]))
+
+    def encode(wav: th.Tensor, path: Path, settings: dict[str, Any]):
+        # Encode next to the final path and rename, so a rendition is never served
+        # half written.
+        tmp = path.with_name(f".{path.name}.tmp")
+        encode_aac(wav, tmp, samplerate, **settings)
+        os.replace(tmp, path)
+
+    if pool is None:
+        for task in tasks:
+            encode(*task)
+        return
+    futures = [pool.submit(encode, *task) for task in tasks]
+    for future in futures:
+        future.result()
+
+
+def save_stem_segments(sid: str, segment_seconds: float = 6.,
+                       pool: Optional[Executor] = None):
+    """Split the final mp3 stems of the song ID into HLS segments, next to an
+    `index.m3u8` manifest, see `utils.get_hls_dir`.
+
+    The mp3 frames are copied without re-encoding. Both stems have the same length and
+    encoder settings, so they are cut at the same frames and the segments of the vocals
+    and the instrumental stay aligned."""
+    def segment(path: Path, out_dir: Path):
+        # Write to a temporary directory and rename, so a manifest is never served
+        # before all of its segments exist.
+        tmp = out_dir.with_name(f".{out_dir.name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        sp.run(['ffmpeg', '-y', '-loglevel', 'panic', '-i', str(path), '-c', 'copy',
+                '-f', 'hls', '-hls_time', str(segment_seconds),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', str(tmp / 'segment%05d.ts'),
+                str(tmp / 'index.m3u8')], check=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp, out_dir)
+
+    tasks = [(path, get_hls_dir(stem, sid))
+             for path, stem in zip(get_stem_paths(sid), ("vocal", "instrumental"))]
+    if pool is None:
+        for task in tasks:
+            segment(*task)
+        return
+    futures = [pool.submit(segment, *task) for task in tasks]
+    for future in futures:
+        future.result()
+
+
+def save_stems(stems: th.Tensor, paths: tuple[Path, Path], samplerate: int,
+               pool: Optional[Executor] = None, **kwargs):
+    """Save the [2, C, T] output of `separate_mix`. If a pool is given, both stems
+    are encoded in parallel."""
+    if pool is None:
+        for wav, path in zip(stems, paths):
+            save_audio(wav, str(path), samplerate, **kwargs)
+        return
+    futures = [pool.submit(save_audio, wav, str(path), samplerate, **kwargs)
+               for wav, path in zip(stems, paths)]
+    for future in futures:
+        future.result()
 
 
 def separate_vocals(
@@ -41,6 +273,13 @@ def separate_vocals(
     verbose: bool = True,
     on_progress: typing.Optional[typing.Callable[[
         float, float], None]] = None,
+    model: Any = None,
+    stream: bool = False,
+    on_playable: typing.Optional[typing.Callable[[], None]] = None,
+    precision: str = "float32",
+    mp3_preset: int = 2,
+    variants: typing.Sequence[str] = (),
+    hls: bool = False,
 ):
     """Separate the sources for the song ID
 
@@ -55,138 +294,76 @@ def separate_vocals(
         int24 (bool): Save wav output as 24 bits wav.
         float32 (bool): Save wav output as float32 (2x bigger).
         clip_mode (str): Strategy for avoiding clipping: rescaling entire signal if necessary
-                        (rescale) or hard clipping (clamp).
+                        (rescale) or hard clipping (clamp). Used for the mp3 and the
+                        variants alike.
         mp3 (bool): Convert the output wavs to mp3.
         mp3_bitrate (int): Bitrate of converted mp3.
         verbose (bool): Verbose
+        model: A warmed model to use, e.g. from `ModelManager`. If None, the model is
+               fetched from the process-wide registry.
+        stream (bool): Encode the stems while separating into `{sid}.partial.mp3`, which
+                       can be served before the separation is done. The files are renamed
+                       to `{sid}.mp3` at the end. As the peak of the whole track is unknown
+                       while streaming, clipping is always prevented by clamping, in the
+                       variants too.
+        on_playable: Called once the first stretch of both streamed stems is written.
+        precision (str): "float32", or "int8" for the dynamically quantized model, which
+                         runs on CPU only. Faster at the cost of a small SDR drop.
+        mp3_preset (int): LAME quality preset of the mp3 encoder, from 2 (highest quality)
+                          to 7 (fastest).
+        variants (list of str): Compact renditions to encode besides the mp3, keys of
+                                `VARIANT_SETTINGS` ("aac", "preview").
+        hls (bool): Also split the mp3 stems into HLS segments with a manifest.
     """
-
-    if os.environ.get("LIMIT_CPU", False):
-        th.set_num_threads(1)
-        jobs = 1
-    else:
-        # Number of jobs. This can increase memory usage but will be much faster when
-        # multiple cores are available.
-        jobs = os.cpu_count()
-
-    if th.cuda.is_available():
-        device = "cuda"
-    elif th.backends.mps.is_available():
-        device = "mps"
-    else:
-        device = "cpu"
-    args = argparse.Namespace()
-    args.sid = sid
-    args.model = model_name
-    args.device = device
-    args.shifts = shifts
-    args.overlap = overlap
-    args.stem = stem
-    args.int24 = int24
-    args.float32 = float32
-    args.clip_mode = clip_mode
-    args.mp3 = mp3
-    args.mp3_bitrate = mp3_bitrate
-    args.jobs = jobs
-    args.verbose = verbose
-    args.filename = "{sid}.{ext}"
-    args.split = True
-    args.segment = None
-    args.name = model_name
-    args.repo = None
-
-    model: Any = None
-    try:
-        model: Any = get_model_from_args(args)
-    except ModelLoadingError as error:
-        fatal(error.args[0])
-
-    if args.segment is not None and args.segment < 8:
-        fatal("Segment must greater than 8. ")
-
-    if ".." in args.filename.replace("\\", "/").split("/"):
-        fatal('".." must not appear in filename. ')
+    device = get_device(precision)
+    if model is None:
+        try:
+            model = get_model_manager().get_model(model_name, device, precision=precision)
+        except ModelLoadingError as error:
+            fatal(error.args[0])
 
     if isinstance(model, BagOfModels):
         print(
             f"Selected model is a bag of {len(model.models)} models. "
             "You will see that many progress bars per track."
         )
-        if args.segment is not None:
-            for sub in model.models:
-                sub.segment = args.segment
-    else:
-        if args.segment is not None:
-            model.segment = args.segment
 
-    model.to(device)
-    model.eval()
-
-    if args.stem is not None and args.stem not in model.sources:
+    if stem is not None and stem not in model.sources:
         fatal(
             'error: stem "{stem}" is not in selected model. STEM must be one of {sources}.'.format(
-                stem=args.stem, sources=", ".join(model.sources)
+                stem=stem, sources=", ".join(model.sources)
             )
         )
 
-    if args.mp3:
-        ext = "mp3"
-    else:
-        ext = "wav"
-    vocal_stem = Path(VOCALS_DIR) / args.filename.format(
-        sid=sid,
-        ext=ext,
-    )
-    vocal_stem.parent.mkdir(parents=True, exist_ok=True)
-    non_vocal_stem = Path(NO_VOCALS_DIR) / args.filename.format(
-        sid=sid,
-        ext=ext,
-    )
-    non_vocal_stem.parent.mkdir(parents=True, exist_ok=True)
-
-    print(
-        f"Separated tracks will be stored in {vocal_stem} and {non_vocal_stem}")
-    track = Path(RAW_AUDIO_DIR, f"{sid}.mp3")
-    if not track.exists():
-        print(
-            f"File {track} does not exist. If the path contains spaces, "
-            'please try again after surrounding the entire path with quotes "".',
-            file=sys.stderr,
-        )
+    paths = get_stem_paths(sid, "mp3" if mp3 else "wav")
+    print(f"Separated tracks will be stored in {paths[0]} and {paths[1]}")
+    mix = load_mix(sid, model)
+    if mix is None:
         return
-    print(f"Separating track {track}")
-    wav = load_track(track, model.audio_channels, model.samplerate)
+    wav, ref = mix
 
-    ref = wav.mean(0)
-    wav = (wav - ref.mean()) / ref.std()
-    sources = apply_model(
-        model,
-        wav[None],
-        device=args.device,
-        shifts=args.shifts,
-        split=args.split,
-        overlap=args.overlap,
-        progress=True,
-        on_progress=on_progress,
-        num_workers=args.jobs or 1,
-    )[0]
-    sources = sources * ref.std() + ref.mean()
-
-    kwargs = {
-        "samplerate": model.samplerate,
-        "bitrate": args.mp3_bitrate,
-        "clip": args.clip_mode,
-        "as_float": args.float32,
-        "bits_per_sample": 24 if args.int24 else 16,
-    }
-    sources = list(sources)
-    save_audio(sources.pop(model.sources.index(args.stem)),
-               str(vocal_stem), **kwargs)
-    # Warning : after poping the stem, selected stem is no longer in the list 'sources'
-    other_stem = th.zeros_like(sources[0])
-    for i in sources:
-        other_stem += i
-    save_audio(other_stem, str(non_vocal_stem), **kwargs)
+    writers = open_stem_streams(paths, model, mp3_bitrate, mp3_preset) if stream and mp3 else []
+    try:
+        stems = separate_mix(model, wav, ref, stem, shifts, overlap, on_progress,
+                             writers, on_playable, device)
+    except Exception:
+        discard_stem_streams(writers)
+        raise
+    if writers:
+        clip_mode = "clamp"
+    with ThreadPoolExecutor(len(paths)) as pool:
+        if writers:
+            finish_stem_streams(writers, paths)
+        else:
+            save_stems(stems, paths, model.samplerate, pool,
+                       bitrate=mp3_bitrate,
+                       clip=clip_mode,
+                       as_float=float32,
+                       bits_per_sample=24 if int24 else 16,
+                       preset=mp3_preset)
+        save_stem_variants(stems, sid, model.samplerate, variants, pool, clip_mode)
+        if hls and mp3:
+            save_stem_segments(sid, pool=pool)
 
 
 if __name__ == "__main__":
@@ -18,42 +18,122 @@ VOCALS_DIR = os.path.join(STORAGE_DIR, "vocal")
 os.makedirs(VOCALS_DIR, exist_ok=True)
 MIDI_DIR = os.path.join(STORAGE_DIR, "midi")
 os.makedirs(MIDI_DIR, exist_ok=True)
+HLS_DIR = os.path.join(STORAGE_DIR, "hls")
+os.makedirs(HLS_DIR, exist_ok=True)
 logger.info("Storage directories initialized. Path: %s.", STORAGE_DIR)
 
+# Renditions of the separated stems: file extension and media type. The mp3 is always
+# produced, the others only if enabled in the separation pipeline.
+AUDIO_VARIANTS = {
+    "mp3": ("mp3", "audio/mpeg"),
+    "aac": ("m4a", "audio/mp4"),
+    "preview": ("preview.m4a", "audio/mp4"),
+}
 
-def get_instrumental_path(filename: str) -> str | None:
+
+def get_instrumental_path(filename: str, variant: str = "mp3") -> str | None:
     """
     Returns the full path to the song file in the storage directory.
 
     Args:
         filename (str): The name of the song file.
+        variant (str): The rendition, one of `AUDIO_VARIANTS`.
 
     Returns:
         str: The full path to the song file.
     """
-    path = Path(NO_VOCALS_DIR, f"{filename}.mp3")
+    path = Path(NO_VOCALS_DIR, f"{filename}.{AUDIO_VARIANTS[variant][0]}")
     if path.exists():
         return str(path)
     else:
         return None
 
 
-def get_vocal_path(filename: str) -> str | None:
+def get_vocal_path(filename: str, variant: str = "mp3") -> str | None:
     """
     Returns the full path to the song file in the storage directory.
 
     Args:
         filename (str): The name of the song file.
+        variant (str): The rendition, one of `AUDIO_VARIANTS`.
 
     Returns:
         str: The full path to the song file.
     """
-    path = Path(VOCALS_DIR, f"{filename}.mp3")
+    path = Path(VOCALS_DIR, f"{filename}.{AUDIO_VARIANTS[variant][0]}")
+    if path.exists():
+        return str(path)
+    else:
+        return None
+
+def get_partial_instrumental_path(filename: str) -> str | None:
+    """
+    Returns the full path to the instrumental that is still being streamed out of
+    the separator, if any.
+
+    Args:
+        filename (str): The name of the song file.
+
+    Returns:
+        str: The full path to the partial song file.
+    """
+    path = Path(NO_VOCALS_DIR, f"{filename}.partial.mp3")
+    if path.exists():
+        return str(path)
+    else:
+        return None
+
+
+def get_partial_vocal_path(filename: str) -> str | None:
+    """
+    Returns the full path to the vocals that are still being streamed out of
+    the separator, if any.
+
+    Args:
+        filename (str): The name of the song file.
+
+    Returns:
+        str: The full path to the partial song file.
+    """
+    path = Path(VOCALS_DIR, f"{filename}.partial.mp3")
+    if path.exists():
+        return str(path)
+    else:
+        return None
+
+
+def get_hls_dir(stem: str, filename: str) -> Path:
+    """
+    Returns the directory holding the HLS manifest and segments of a stem.
+
+    Args:
+        stem (str): "instrumental" or "vocal".
+        filename (str): The name of the song file.
+    """
+    return Path(HLS_DIR, stem, filename)
+
+
+def get_hls_path(stem: str, filename: str, name: str) -> str | None:
+    """
+    Returns the full path to a file of the HLS rendition of a stem.
+
+    Args:
+        stem (str): "instrumental" or "vocal".
+        filename (str): The name of the song file.
+        name (str): "index.m3u8" or the name of a segment listed in it.
+
+    Returns:
+        str: The full path to the manifest or segment.
+    """
+    if stem not in ("instrumental", "vocal") or Path(name).name != name:
+        return None
+    path = get_hls_dir(stem, filename) / name
     if path.exists():
         return str(path)
     else:
         return None
 
+
 def get_midi_path(filename: str) -> str | None:
     """
     Returns the full path to the MIDI file in the storage directory.
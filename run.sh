@@ -11,7 +11,7 @@ sleep 1 # wait briefly
 # Start FastAPI backend
 cd backend
 uvicorn main:app --host 0.0.0.0 --port 8000 &
-celery -A services.process_request.celery worker -l info --concurrency=1 --pool=solo &
+celery -A services.process_request.celery worker -l info --pool=threads --concurrency=2 &
 
 # Start Nginx (serving frontend)
 nginx -g 'daemon off;'